@@ -1,6 +1,9 @@
 import time
 import os
 import sys
+import argparse
+import threading
+from collections import OrderedDict
 from flask import Flask, redirect, render_template, request, abort
 
 from functions.messagereader import MessageReader
@@ -10,13 +13,27 @@ from functions.wordcloud import WordCloud
 
 app = Flask(__name__)
 
+# The maximum number of GUIConvoReaders kept in memory. Readers are built the first time their conversation is
+# requested, and the least recently used reader is dropped once there are more than this many
+GUI_CACHE_SIZE = 8
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Browser interface for your facebook messages")
+    parser.add_argument('-c', '--cache-size', type=int, default=GUI_CACHE_SIZE,
+                        help="the number of conversations to keep loaded at once (default: {0})"
+                        .format(GUI_CACHE_SIZE))
+    args = parser.parse_args()
+    if args.cache_size < 1:
+        parser.error("--cache-size must be at least 1")
+    GUI_CACHE_SIZE = args.cache_size
+
     print("For the time being please use Chrome")
     print("Setting up could take a few moments ", end="")
 
 initial_time = time.time()
 m = MessageReader()
-all_gui_convo_readers = [m.get_convo_gui(i) for i in range(1, len(m) + 1)]
+gui_convo_readers = OrderedDict()  # conversation number -> GUIConvoReader, least recently used first
+gui_convo_readers_lock = threading.Lock()  # flask may serve several requests for a conversation at once
 
 
 # ---------------------------------------------------   HOME PAGE   -------------------------------------------------- #
@@ -70,7 +87,7 @@ def graphs(convo_num):
 
 @app.route('/graphs/conversation/<int:convo_num>/next/')
 def next_page(convo_num):
-    if convo_num == len(all_gui_convo_readers):
+    if convo_num == len(m):
         return redirect('/graphs/conversation/{0}/'.format(1), code=302)
     return redirect('/graphs/conversation/{0}/'.format(convo_num + 1), code=302)
 
@@ -78,7 +95,7 @@ def next_page(convo_num):
 @app.route('/graphs/conversation/<int:convo_num>/prev/')
 def prev_page(convo_num):
     if convo_num == 1:
-        return redirect('/graphs/conversation/{0}/'.format(len(all_gui_convo_readers)), code=302)
+        return redirect('/graphs/conversation/{0}/'.format(len(m)), code=302)
     return redirect('/graphs/conversation/{0}/'.format(convo_num - 1), code=302)
 
 
@@ -178,7 +195,14 @@ def coming_soon():
 def load_all_gui(convo_num) -> GUIConvoReader:
     if convo_num < 1 or len(m) < convo_num:
         abort(404)
-    return all_gui_convo_readers[convo_num - 1]
+    with gui_convo_readers_lock:
+        if convo_num in gui_convo_readers:
+            gui_convo_readers.move_to_end(convo_num)
+        else:
+            gui_convo_readers[convo_num] = m.get_convo_gui(convo_num)
+            while len(gui_convo_readers) > GUI_CACHE_SIZE:
+                gui_convo_readers.popitem(last=False)
+        return gui_convo_readers[convo_num]
 
 if __name__ == '__main__':
     print("(took {0:.2f} seconds to load)".format(time.time() - initial_time))
@@ -0,0 +1,168 @@
+import os
+import json
+from bisect import bisect_right
+from collections import Counter
+from datetime import timedelta
+
+from functions.baseconvoreader import BaseConvoReader
+from functions.customdate import CustomDate
+
+
+class AggregateIndex:
+    """Totals for every conversation, saved next to the conversation data so that analysis spanning all conversations
+    doesn't need to load and scan each conversation.
+
+    For each conversation the index holds:
+        length        the number of messages, used with the conversation's name to check the index is up to date
+        people        the lower case names of the people in the conversation, as returned by get_people()
+        first_day     the day of the first and last message, as days since CustomDate.EPOCH
+        last_day
+        days          person -> sorted list of the days the person sent messages on
+        totals        person -> list of the running total of messages the person sent, through each day in days
+        emojis        emoji -> frequency for the whole conversation, as returned by raw_emojis()
+        person_emojis person -> {emoji: frequency}, as returned by raw_emojis(person)
+    """
+
+    PATH = 'data/aggregates.json'
+    VERSION = 4
+
+    def __init__(self, conversations):
+        self.conversations = conversations
+
+    # --------------------------------------------------   BUILDING   ------------------------------------------------ #
+
+    @classmethod
+    def build(cls, msgs, previous=None, changed=()):
+        """Returns an AggregateIndex for msgs
+        Parameters:
+            msgs: a dictionary mapping conversation names to lists of (person, message, date-time string) messages,
+                  or to StoredConversations
+            previous (optional): an AggregateIndex whose entries can be reused for conversations with the same name and
+                                 length, other than those in changed
+            changed (optional): names of conversations that have been edited and must be summarized again
+        """
+        conversations = dict()
+        for name, convo in msgs.items():
+            if previous is not None and name not in changed and name in previous.conversations \
+                    and previous.conversations[name]['length'] == len(convo):
+                conversations[name] = previous.conversations[name]
+            else:
+                conversations[name] = cls.summarize(BaseConvoReader(name, convo, 'gui'))
+        return cls(conversations)
+
+    @staticmethod
+    def summarize(reader: BaseConvoReader) -> dict:
+        """Returns the index entry for the conversation read by reader"""
+        days = {person: Counter() for person in reader.get_people()}
+        for person, time in zip(reader._senders, reader._times):
+            days[person][time // (24 * 60)] += 1
+
+        totals = dict()
+        for person, counts in days.items():
+            totals[person] = []
+            for day in sorted(counts):
+                totals[person].append(counts[day] + (totals[person][-1] if totals[person] else 0))
+
+        return {
+            'length': len(reader),
+            'people': reader.get_people(),
+            'first_day': reader._times[0] // (24 * 60),
+            'last_day': reader._times[-1] // (24 * 60),
+            'days': {person: sorted(counts) for person, counts in days.items()},
+            'totals': totals,
+            'emojis': reader.raw_emojis(),
+            'person_emojis': {person: reader.raw_emojis(person) for person in reader.get_people()},
+        }
+
+    # --------------------------------------------------   BUILDING   ------------------------------------------------ #
+
+    #
+
+    # ---------------------------------------------   LOADING AND SAVING   ------------------------------------------- #
+
+    @classmethod
+    def load(cls, path=PATH):
+        """Returns the AggregateIndex saved at path, or None if there isn't one saved by this version"""
+        if not os.path.isfile(path):
+            return None
+        with open(path, mode='r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != cls.VERSION:
+            return None
+        return cls(index['conversations'])
+
+    def save(self, path=PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'conversations': self.conversations}, f)
+
+    def matches(self, msgs) -> bool:
+        """Returns whether this index has an entry of the right length for every conversation in msgs, and no others"""
+        if len(msgs) != len(self.conversations):
+            return False
+        for name, convo in msgs.items():
+            if name not in self.conversations or self.conversations[name]['length'] != len(convo):
+                return False
+        return True
+
+    # ---------------------------------------------   LOADING AND SAVING   ------------------------------------------- #
+
+    #
+
+    # --------------------------------------------------   QUERIES   ------------------------------------------------- #
+
+    def messages_between(self, start_day, end_day, names=None) -> Counter:
+        """Returns a Counter of conversation names mapped to the number of messages sent on days start_day through
+        end_day (inclusive), with days counted from CustomDate.EPOCH. names is the order to add conversations in"""
+        res = Counter()
+        for name in (self.conversations if names is None else names):
+            entry = self.conversations[name]
+            res[name] = 0
+            for person, days in entry['days'].items():
+                totals = entry['totals'][person]
+                through_end = bisect_right(days, end_day)
+                before_start = bisect_right(days, start_day - 1)
+                res[name] += (totals[through_end - 1] if through_end else 0) \
+                    - (totals[before_start - 1] if before_start else 0)
+        return res
+
+    def emojis(self, person=None, names=None) -> Counter:
+        """Returns a Counter of emoji frequencies in all conversations, or of just those sent by person. names is the
+        order to add conversations in, which decides the order of emojis with equal frequencies"""
+        res = Counter()
+        for name in (self.conversations if names is None else names):
+            entry = self.conversations[name]
+            if person is None:
+                res += Counter(entry['emojis'])
+            elif person in entry['person_emojis']:
+                res += Counter(entry['person_emojis'][person])
+        return res
+
+    def messages_by_day(self, person=None) -> list:
+        """Returns a list of tuples (CustomDate, number of messages) for every day in the span of any conversation,
+        sorted by date. If person is passed only messages they sent are counted, and only conversations they are in
+        """
+        total = Counter()
+        for entry in self.conversations.values():
+            if person is not None and person not in entry['people']:
+                continue
+            for day in range(entry['first_day'], entry['last_day'] + 1):
+                total[day] += 0
+            for pers, days in entry['days'].items():
+                if person is None or pers == person:
+                    totals = entry['totals'][pers]
+                    for i, day in enumerate(days):
+                        total[day] += totals[i] - (totals[i - 1] if i else 0)
+        return [(CustomDate.from_date(CustomDate.EPOCH + timedelta(days=day)), total[day]) for day in sorted(total)]
+
+    def people(self) -> set:
+        """Returns the set of lower case names of everyone in any conversation"""
+        return set(person for entry in self.conversations.values() for person in entry['people'])
+
+    # --------------------------------------------------   QUERIES   ------------------------------------------------- #
+
+    def __len__(self):
+        return len(self.conversations)
+
+    def __repr__(self):
+        return "AggregateIndex.load({0})".format(repr(self.PATH))
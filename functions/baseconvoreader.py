@@ -1,11 +1,23 @@
 from collections import Counter
+from collections.abc import Sequence
+from array import array
 from math import ceil
 import re
 import os
 import subprocess
-from difflib import SequenceMatcher
-
-from functions.customdate import CustomDate
+import pickle
+import hashlib
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, without it analysis loops over the python columns
+    numpy = None
+
+from functions.customdate import CustomDate, EpochDates
+from functions.messagestore import StoredConversation, MessageTexts
+from functions.wordindex import WordIndex
+from functions.trigramindex import TrigramIndex
+from functions.fuzzysearch import FuzzySearch
 import functions.emojis as emojis
 from functions.wordcloud import WordCloud
 
@@ -14,20 +26,34 @@ class BaseConvoReader:
     """Provides base analysis of conversations, extended by ConvoReader and GUIConvoReader classes"""
 
     BASE_PATH = 'data/conversation_data/'
+    WORD_FREQS_FILE = 'word_freqs.pickle'  # cache of _individual_words, see _load_word_freqs()
+    WORD_FREQS_VERSION = 1
+    USE_NUMPY = numpy is not None  # whether histograms and totals are computed on numpy arrays, when it's installed
 
     def __init__(self, convo_name, convo_list, rank):
         """Parameters:
             convo_name: A string for the conversation name, found in your facebook archive
-            convo_list: A 2D list with inner lists of the format [person_name (str), message (str), date-time (str)]
+            convo_list: A 2D list with inner lists of the format [person_name (str), message (str), date-time (str)],
+                or a StoredConversation whose message text is left in the store and only decoded when needed
         """
         self._name = convo_name.lower()
-        self._convo = [[name.lower(), msg, CustomDate(date)] for name, msg, date in convo_list]
+        self._senders, self._messages, (self._times, self._time_zones, self._zone_names) = self.columns(convo_list)
+        # times are minutes since CustomDate.EPOCH, CustomDate objects are only created for display
+        self._dates = EpochDates(self._times, self._time_zones, self._zone_names)
+        self._convo = ConvoRows(self._senders, self._messages, self._dates)
         self._people = self.get_people()
         self._kicked_or_left = [person for person in self._people if person not in self._name.split(', ')]
-        self._individual_words = self._cleaned_word_freqs()
+        self._word_freqs = None  # see _individual_words
         self._len = len(self._convo)
         self._path = BaseConvoReader.BASE_PATH + str(rank) + '/'
+        # readers without a rank (e.g. 'gui') share a folder, so only ranked readers cache their word frequencies
+        self._cache_word_freqs = isinstance(rank, int)
         self._word_cloud = None
+        self._running_totals = dict()  # person (None for everyone) -> array, see _running_totals_by_day()
+        self._word_index = None
+        self._trigram_index = None
+        self._arrays = None  # (sender ids, times) numpy arrays, see _numpy_arrays()
+        self._stats = None  # person -> totals for their messages, see _person_stats()
 
     # -----------------------------------------------   PUBLIC METHODS ---------------------------------------------- #
 
@@ -37,15 +63,32 @@ class BaseConvoReader:
         """
         if hasattr(self, '_people'):
             return self._people
+        return self.people_in(self._name, self._senders)
 
+    @staticmethod
+    def columns(convo_list):
+        """Returns the tuple (senders, messages, (times, time_zones, zone_names)) of columns for convo_list, a list of
+        [person_name, message, date-time] messages or a StoredConversation. senders is a list of lower case names,
+        messages a sequence of message text and the times are as returned by _parse_dates()
+        """
+        if isinstance(convo_list, StoredConversation):
+            return [name.lower() for name in convo_list.senders()], convo_list.messages, convo_list.timestamps()
+        return ([name.lower() for name, msg, date in convo_list], [msg for name, msg, date in convo_list],
+                BaseConvoReader._parse_dates(date for _, _, date in convo_list))
+
+    @staticmethod
+    def people_in(convo_name, senders) -> list:
+        """Returns the sorted list of lower case names of the people in the conversation convo_name (in lower case)
+        with the lower case senders senders, as returned by get_people()
+        """
         duplicate = re.compile("duplicate #\d+", re.IGNORECASE)
         people = []
-        for person in sorted(self._name.split(', ')):
+        for person in sorted(convo_name.split(', ')):
             if duplicate.fullmatch(person) is None:
                 people.append(person)
-        for person, msg, date in self._convo:
-            if person.lower() not in people:
-                people.append(person.lower())
+        for person in set(senders):
+            if person not in people:
+                people.append(person)
         return sorted(people)
 
     def save_word_freq(self, path=None):
@@ -89,7 +132,7 @@ class BaseConvoReader:
             assert person in self._people, "{0} isn't in this conversation; this conversation is for" \
                                            " {1}".format(person, str(self._people))
         res = Counter()
-        for pers, msg, date in self._convo:
+        for pers, msg in zip(self._senders, self._messages):
             if person is None or pers == person:
                 res.update(msg)
         return res
@@ -100,29 +143,17 @@ class BaseConvoReader:
             person (optional): the name of the person whose emojis frequencies you would like. If left to default
                 None, an aggregate total for the conversation is returned
         Return:
-            Counter with keys being emojis (or private use unicode values*) and values being their frequency
+            Counter with keys being emojis (or private use unicode values*) and values being their frequency. Emojis
+            made of several characters, like flags and skin tones, are counted as one emoji
         *http://stackoverflow.com/questions/38780324/python3-src-encodings-of-emojis
         """
-        chars = self.raw_characters(person=person)
-        res = Counter()
-        for key, val in chars.most_common():
-            if '\\U000' in repr(key) and key is not None:
-                try:
-                    temp_emoji = emojis.src_to_emoiji(key)
-                    if temp_emoji in res:
-                        res[temp_emoji] += val
-                    else:
-                        res[temp_emoji] = val
-                except KeyError:
-                    res[key] = val
-            else:
-                for unicode_emoji in emojis.UNICODE_EMOJI:
-                    if unicode_emoji == key:
-                        if key in res:
-                            res[key] += val
-                        else:
-                            res[key] = val
-        return res
+        if person is not None:
+            assert type(person) is str, "Optional parameter person must be a string"
+            person = person.lower()
+            assert person in self._people, "{0} isn't in this conversation; this conversation is for" \
+                                           " {1}".format(person, str(self._people))
+        return emojis.count_emojis(msg for pers, msg in zip(self._senders, self._messages)
+                                   if person is None or pers == person)
 
     def raw_messages(self, name=None):
         """Returns information about the number of messages in the chat. Return type depends on parameters passed
@@ -185,23 +216,64 @@ class BaseConvoReader:
         else:
             filt = lambda x: True
 
-        start = self._convo[0][2]
-        end = self._convo[-1][2]
-        days = end - start
-
-        msg_freq = [[None, 0] for i in range(days + 1)]
-        for person, msg, date in self._convo:
-            if filt(person.lower()):
-                if date.minutes() < forward_shift:  # if we are counting this time as the previous day
-                    msg_freq[max(0, date - start - 1)][1] += 1
-                else:  # this time is ahead of the shift, so it is counted as the right day
-                    msg_freq[date - start][1] += 1
+        start = self._dates[0]
+        start_day = self._times[0] // (24 * 60)
+        days = self._times[-1] // (24 * 60) - start_day
+
+        if forward_shift == 0:  # days are calendar days, so use the running totals kept for each day
+            totals = [self._running_totals_by_day(person) for person in dict.fromkeys(contact or [None])]
+            msg_freq = [[None, sum(total[day + 1] - total[day] for total in totals)] for day in range(days + 1)]
+        elif self._use_numpy():
+            _, times = self._numpy_arrays()
+            times = times[self._numpy_mask(contact)]
+            day = times // (24 * 60) - start_day
+            # times before forward_shift count as the previous day
+            day = numpy.where(times % (24 * 60) < forward_shift, numpy.maximum(day - 1, 0), day)
+            msg_freq = [[None, num] for num in numpy.bincount(day, minlength=days + 1).tolist()]
+        else:
+            msg_freq = [[None, 0] for i in range(days + 1)]
+            for person, time in zip(self._senders, self._times):
+                if filt(person):
+                    day = time // (24 * 60) - start_day
+                    if time % (24 * 60) < forward_shift:  # if we are counting this time as the previous day
+                        msg_freq[max(0, day - 1)][1] += 1
+                    else:  # this time is ahead of the shift, so it is counted as the right day
+                        msg_freq[day][1] += 1
 
         for day in range(len(msg_freq)):
             msg_freq[day][0] = CustomDate.from_date(start + day)
 
         return msg_freq
 
+    def raw_msgs_between(self, start=None, end=None, contact=None) -> int:
+        """Returns the number of messages sent in a period of days
+        Parameters:
+            start (optional): (str) A date string for the first day of the period, in the form "{month}/{day}/{year}".
+                              Defaults to the date of the first message
+            end (optional): (str) A date string for the last day of the period, in the same form as start. Defaults to
+                            the date of the last message
+            contact (optional): the name (as a string) of the person you are interested in, or a list of names
+                (default: all contacts)
+        Return:
+            The integer number of messages sent from the start of start through the end of end
+        """
+        CustomDate.assert_dates(start, end)
+        contact = self._assert_contact(contact)
+
+        first_day = self._times[0] // (24 * 60)
+        last_day = self._times[-1] // (24 * 60)
+        start_day = first_day if start is None else CustomDate.from_date_string(start).epoch_minutes() // (24 * 60)
+        end_day = last_day if end is None else CustomDate.from_date_string(end).epoch_minutes() // (24 * 60)
+        start_day, end_day = max(start_day, first_day), min(end_day, last_day)
+        if start_day > end_day:
+            return 0
+
+        res = 0
+        for person in dict.fromkeys(contact or [None]):
+            totals = self._running_totals_by_day(person)
+            res += totals[end_day - first_day + 1] - totals[start_day - first_day]
+        return res
+
     def raw_msgs_by_weekday(self, contact=None, percent=True) -> list:
         """Returns the frequency of chatting by days of week
             Parameters:
@@ -219,10 +291,16 @@ class BaseConvoReader:
         else:
             key = lambda x: x in contact
 
-        weekday_freq = [0 for _ in range(7)]
-        for p, m, d in self._convo:
-            if key(p):
-                weekday_freq[d.weekday()] += 1
+        epoch_weekday = CustomDate.EPOCH.weekday()
+        if self._use_numpy():
+            _, times = self._numpy_arrays()
+            days = times[self._numpy_mask(contact)] // (24 * 60)
+            weekday_freq = numpy.bincount((days + epoch_weekday) % 7, minlength=7).tolist()
+        else:
+            weekday_freq = [0 for _ in range(7)]
+            for p, time in zip(self._senders, self._times):
+                if key(p):
+                    weekday_freq[(time // (24 * 60) + epoch_weekday) % 7] += 1
 
         if percent:  # return a percentage of messages by day
             weekday_total = sum(weekday_freq)
@@ -254,10 +332,16 @@ class BaseConvoReader:
 
         msg_bucket = [[CustomDate.minutes_to_time(i * window), 0] for i in range(ceil(60 * 24 / window))]
 
-        for person, msg, date in self._convo:
-            if filt(person.lower()):
-                index = (date.minutes() // window) % (len(msg_bucket))
-                msg_bucket[index][1] += 1
+        if self._use_numpy():
+            _, times = self._numpy_arrays()
+            indexes = (times[self._numpy_mask(contact)] % (24 * 60) // window) % len(msg_bucket)
+            for i, num in enumerate(numpy.bincount(indexes, minlength=len(msg_bucket)).tolist()):
+                msg_bucket[i][1] = num
+        else:
+            for person, time in zip(self._senders, self._times):
+                if filt(person):
+                    index = (time % (24 * 60) // window) % (len(msg_bucket))
+                    msg_bucket[index][1] += 1
         for i in range(len(msg_bucket)):
             msg_bucket[i][1] /= (len(self) / 100)
         return msg_bucket
@@ -345,9 +429,15 @@ class BaseConvoReader:
         if ignore_case:
             key = lambda x: x.lower()
             query = query.lower()
+        candidates = self.word_index().candidates(query)
+        trigram_candidates = self.trigram_index().candidates([query])
+        if candidates is None:
+            candidates = trigram_candidates
+        elif trigram_candidates is not None:
+            candidates = sorted(set(candidates).intersection(trigram_candidates))
         indexes = []
-        for i in range(len(self._convo)):
-            if query in key(self._convo[i][1]):
+        for i in (range(len(self)) if candidates is None else candidates):
+            if query in key(self._messages[i]):
                 indexes.append(i)
         return indexes
 
@@ -364,14 +454,17 @@ class BaseConvoReader:
         indexes = []
         try:
             r = re.compile(query, re.IGNORECASE) if ignore_case else re.compile(query)
-            for i in range(len(self._convo)):
-                if r.fullmatch(self._convo[i][1]) is not None:
-                    indexes.append(i)
-            return indexes
+            literals = TrigramIndex.required_literals(query)
         except re.error:
             raise re.error("\"{0}\" is not a valid regex string".format(query))
+        # only messages containing every literal the regex requires can match it
+        candidates = self.trigram_index().candidates(literals)
+        for i in (range(len(self)) if candidates is None else candidates):
+            if r.fullmatch(self._messages[i]) is not None:
+                indexes.append(i)
+        return indexes
 
-    def raw_fuzzy_match_indexes(self, query, ignore_case=False, junk=' ', min_ratio=0.6):
+    def raw_fuzzy_match_indexes(self, query, ignore_case=False, junk=' ', min_ratio=0.6, num=None):
         """Returns a list with the indexes of each message that match the passed message with at least min_ratio
         Parameters:
             query (str): The text to search for
@@ -380,6 +473,8 @@ class BaseConvoReader:
                         a similarity/difference score
             min_ratio (double): The minimum similarity ratio needed to consider a string as "matched". Between 0 and 1
                                 with 0 being no match and 1 being a full match
+            num (int|None): If an int, only the indexes of the num best matches are returned, best match first.
+                            Otherwise every match is returned, in order
         """
         assert isinstance(query, str), "query must be a string. Received {}: {}".format(type(query), str(query))
         assert isinstance(ignore_case, bool), "ignore_case must be a boolean. Received {}: {}"\
@@ -389,19 +484,34 @@ class BaseConvoReader:
             "min_ratio must be a float or int. Received {}: {}".format(type(min_ratio), str(min_ratio))
         )
         assert 0 <= min_ratio <= 1, "min_ratio must be between 0 and 1 (inclusive)"
+        assert num is None or (isinstance(num, int) and num >= 0), "num must be None or a non-negative integer"
 
-        if ignore_case:
-            query = query.lower()
-            clean_msg = lambda x: x.lower()
-        else:
-            clean_msg = lambda x: x
-        isjunk = lambda string: string in junk
-        close_enough = lambda str_to_match: SequenceMatcher(isjunk, query, str_to_match).ratio() >= min_ratio
-        matched = []
-        for i in range(len(self)):
-            if close_enough(clean_msg(self._convo[i][1])):
-                matched.append(i)
-        return matched
+        search = FuzzySearch(query.lower() if ignore_case else query, junk)
+        messages = [msg.lower() for msg in self._messages] if ignore_case else self._messages
+        if num is None:
+            return search.matches(messages, min_ratio)
+        return search.best(messages, num, min_ratio)
+
+    def word_index(self) -> WordIndex:
+        """Returns the WordIndex of this conversation's messages, loaded from this conversation's data folder (or built)
+        the first time it's needed. print() it to see its size and build time
+        """
+        if self._word_index is None:
+            self._word_index = WordIndex.for_messages(self._name, self._messages, self._path)
+        return self._word_index
+
+    def save_word_index(self):
+        """Saves the WordIndex of this conversation's messages to its data folder if it had to be built or extended,
+        so it doesn't have to be built again. Setup saves the index of every conversation
+        """
+        if self._cache_word_freqs:  # readers without a rank share a folder
+            self.word_index().save(self._path, self._messages)
+
+    def trigram_index(self) -> TrigramIndex:
+        """Returns the TrigramIndex of this conversation's messages, built the first time it's needed"""
+        if self._trigram_index is None:
+            self._trigram_index = TrigramIndex(self._messages)
+        return self._trigram_index
 
     def raw_longest_messages(self, num=None) -> list:
         """Returns a list of integers corresponding to message indexes, sorted in reverse order based on length (longest
@@ -414,7 +524,7 @@ class BaseConvoReader:
         )
         num = min(num, len(self)) if num is not None else len(self)
 
-        order = Counter({index: len(self._convo[index][1]) for index in range(len(self))})
+        order = Counter({index: len(msg) for index, msg in enumerate(self._messages)})
         return order.most_common(num)
 
     # -----------------------------------------------   PUBLIC METHODS ---------------------------------------------- #
@@ -479,19 +589,16 @@ class BaseConvoReader:
 
         # Sets the start and end dates, finds the appropriate
         #  message number if start/ end are not None, else index 1 for start and len(convo) for end
-        start_date_index = CustomDate.bsearch_index(self._convo, start, key=lambda x: x[2]) if start is not None else 1
-        end_date_index = CustomDate.bsearch_index(self._convo, end, key=lambda x: x[2]) \
-            if start is not None else self._len
+        start_date_index = CustomDate.bsearch_index(self._dates, start) if start is not None else 1
+        end_date_index = CustomDate.bsearch_index(self._dates, end) if start is not None else self._len
 
         convo_start_freq = dict()
         for person in self._people:
             convo_start_freq[person] = []
-        convo_start_freq[self._convo[start_date_index - 1][0]].append(start_date_index - 1)
+        convo_start_freq[self._senders[start_date_index - 1]].append(start_date_index - 1)
         for i in range(start_date_index, end_date_index):
-            curr_date = self._convo[i][2]
-            prev_date = self._convo[i - 1][2]
-            if curr_date.distance_from(prev_date) >= threshold:
-                convo_start_freq[self._convo[i][0]].append(i)
+            if self._times[i] - self._times[i - 1] >= threshold:
+                convo_start_freq[self._senders[i]].append(i)
         return Counter(dict((key.title(), val) for key, val in convo_start_freq.items()))
 
     def _raw_convo_killer(self, threshold, start=None, end=None):
@@ -500,27 +607,73 @@ class BaseConvoReader:
 
         # Sets the start and end dates, finds the appropriate
         #  message number if start/ end are not None, else index 1 for start and len(convo) for end
-        start_date_index = CustomDate.bsearch_index(self._convo, start, key=lambda x: x[2]) if start is not None else 0
-        end_date_index = CustomDate.bsearch_index(self._convo, end, key=lambda x: x[2]) \
-            if start is not None else self._len - 1
+        start_date_index = CustomDate.bsearch_index(self._dates, start) if start is not None else 0
+        end_date_index = CustomDate.bsearch_index(self._dates, end) if start is not None else self._len - 1
 
         convo_start_freq = dict()
         for person in self._people:
             convo_start_freq[person] = []
-        convo_start_freq[self._convo[start_date_index - 1][0]].append(start_date_index - 1)
+        convo_start_freq[self._senders[start_date_index - 1]].append(start_date_index - 1)
         for i in range(start_date_index, end_date_index):
-            curr_date = self._convo[i][2]
-            next_date = self._convo[i + 1][2]
-            if next_date.distance_from(curr_date) >= threshold:
-                convo_start_freq[self._convo[i][0]].append(i)
+            if self._times[i + 1] - self._times[i] >= threshold:
+                convo_start_freq[self._senders[i]].append(i)
         return Counter(dict((key.title(), val) for key, val in convo_start_freq.items()))
 
+    @property
+    def _individual_words(self) -> dict:
+        """A dictionary mapping people in the conversation to Counters of their cleaned word frequencies, computed the
+        first time they're needed so that readers only used for counts and graphs never tokenize their messages
+        """
+        if self._word_freqs is None:
+            content_hash = self._content_hash() if self._cache_word_freqs else None
+            if content_hash is not None:
+                self._word_freqs = self._load_word_freqs(content_hash)
+            if self._word_freqs is None:
+                self._word_freqs = self._cleaned_word_freqs()
+                if content_hash is not None:
+                    self._save_word_freqs(content_hash)
+        return self._word_freqs
+
+    def _content_hash(self) -> str:
+        """Returns a hex digest of who sent each message and what it said, which changes whenever the conversation's
+        messages or participants (e.g. through MessageReader.edit_convo_participants) do"""
+        digest = hashlib.sha1()
+        if isinstance(self._messages, MessageTexts):  # hash the stored text and message lengths without decoding
+            digest.update('\x00'.join(self._senders).encode('utf-8'))
+            digest.update(array('q', (self._messages.byte_length(i) for i in range(len(self._messages)))))
+            digest.update(self._messages.encoded())
+        else:
+            for person, msg in zip(self._senders, self._messages):
+                digest.update(person.encode('utf-8'))
+                digest.update(b'\x00')
+                digest.update(msg.encode('utf-8'))
+                digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def _load_word_freqs(self, content_hash):
+        """Returns the word frequencies saved in this conversation's data folder, or None if there aren't any saved
+        by this version for a conversation with content_hash"""
+        try:
+            with open(self._path + self.WORD_FREQS_FILE, mode='rb') as f:
+                cache = pickle.load(f)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return None
+        if cache.get('version') != self.WORD_FREQS_VERSION or cache.get('hash') != content_hash:
+            return None
+        return cache['words']
+
+    def _save_word_freqs(self, content_hash):
+        os.makedirs(self._path, exist_ok=True)
+        with open(self._path + self.WORD_FREQS_FILE, mode='wb') as f:
+            pickle.dump({'version': self.WORD_FREQS_VERSION, 'hash': content_hash, 'words': self._word_freqs}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
     def _raw_word_freqs(self):
         """Returns a dictionary that maps names of people in the conversation
         to a Counter object of their raw word frequencies
         """
         raw_word_freq = dict()
-        for person, msg, date in self._convo:
+        for person, msg in zip(self._senders, self._messages):
             if person not in raw_word_freq:
                 raw_word_freq[person] = Counter()
             raw_word_freq[person].update(msg.lower().split(' '))
@@ -543,63 +696,122 @@ class BaseConvoReader:
                             cleaned_words[key][striped_word] += freq
         return cleaned_words
 
-    def __msgs_per_person(self):
-        res = dict()
-        for person, msg, date in self._convo:
-            if person not in res:
-                res[person] = 1
+    def _running_totals_by_day(self, person=None) -> array:
+        """Returns an array whose ith element is the number of messages person (or anyone, if person is None) sent
+        before the ith day of this conversation, counting the day of the first message as day 0. The messages sent on
+        days i through j are then res[j + 1] - res[i]. Built the first time it's needed for person
+        """
+        if person not in self._running_totals:
+            first_day = self._times[0] // (24 * 60)
+            num_days = self._times[-1] // (24 * 60) - first_day + 2
+            if self._use_numpy():
+                _, times = self._numpy_arrays()
+                days = times[self._numpy_mask(None if person is None else [person])] // (24 * 60) - first_day + 1
+                totals = array('q', numpy.cumsum(numpy.bincount(days, minlength=num_days)).tolist())
             else:
-                res[person] += 1
-        return Counter(res)
+                totals = array('q', [0]) * num_days
+                for sender, time in zip(self._senders, self._times):
+                    if person is None or sender == person:
+                        totals[time // (24 * 60) - first_day + 1] += 1
+                for i in range(1, len(totals)):
+                    totals[i] += totals[i - 1]
+            self._running_totals[person] = totals
+        return self._running_totals[person]
+
+    @staticmethod
+    def _parse_dates(date_strings):
+        """Parses date-time strings into the tuple (times, time_zones, zone_names), where times is an array of minutes
+        since CustomDate.EPOCH, time_zones an array of codes for each date's time zone and zone_names the list of time
+        zone names those codes index
+        """
+        times, time_zones, zone_names = array('q'), array('H'), []
+        zone_codes = dict()
+        for date_str in date_strings:
+            date = CustomDate(date_str)
+            if date.time_zone not in zone_codes:
+                zone_codes[date.time_zone] = len(zone_names)
+                zone_names.append(date.time_zone)
+            times.append(date.epoch_minutes())
+            time_zones.append(zone_codes[date.time_zone])
+        return times, time_zones, zone_names
+
+    def _use_numpy(self) -> bool:
+        return self.USE_NUMPY and numpy is not None and len(self._times) > 0
+
+    def _numpy_arrays(self):
+        """Returns the tuple (sender_ids, times) of numpy arrays with an element for each message: the index of the
+        sender in self._people and the minutes since CustomDate.EPOCH. Built the first time it's needed
+        """
+        if self._arrays is None:
+            ids = {person: i for i, person in enumerate(self._people)}
+            self._arrays = (numpy.fromiter((ids[person] for person in self._senders), dtype=numpy.int64,
+                                           count=len(self._senders)),
+                            numpy.array(self._times, dtype=numpy.int64))
+        return self._arrays
+
+    def _numpy_mask(self, contact):
+        """Returns a boolean numpy array of which messages were sent by someone in contact (a list of lower case
+        names, or None for everyone)"""
+        sender_ids, _ = self._numpy_arrays()
+        if contact is None:
+            return numpy.ones(len(sender_ids), dtype=bool)
+        return numpy.isin(sender_ids, [self._people.index(person) for person in contact])
+
+    def _person_stats(self) -> dict:
+        """Returns a dictionary mapping each person who sent a message, in the order they first sent one, to a
+        dictionary of totals for their messages:
+            messages    the number of messages they sent
+            words       the number of words in those messages
+            characters  the number of characters in those messages
+            first       the time of their first message, in minutes since CustomDate.EPOCH
+            last        the time of their last message, in minutes since CustomDate.EPOCH
+        Built in a single pass through the conversation the first time it's needed
+        """
+        if self._stats is None:
+            self._stats = dict()
+            for person, msg, time in zip(self._senders, self._messages, self._times):
+                stats = self._stats.get(person)
+                if stats is None:
+                    stats = self._stats[person] = {'messages': 0, 'words': 0, 'characters': 0, 'first': time}
+                stats['messages'] += 1
+                stats['words'] += len(msg.split())
+                stats['characters'] += len(msg)
+                stats['last'] = time
+        return self._stats
+
+    def __msgs_per_person(self):
+        return Counter({person: stats['messages'] for person, stats in self._person_stats().items()})
 
     def __msgs_spoken(self, name):
         name = name.lower()
         if name not in self._people:
             raise Exception("Invalid name passed")
-        num = 0
-        for person, msg, date in self._convo:
-            if person == name:
-                num += 1
-        return num
+        return self._person_stats()[name]['messages'] if name in self._person_stats() else 0
 
     def __words_per_person(self):
-        res = dict()
-        for person, msg, date in self._convo:
-            if person not in res:
-                res[person] = len(msg.split())
-            else:
-                res[person] += len(msg.split())
-        return Counter(res)
+        return Counter({person: stats['words'] for person, stats in self._person_stats().items()})
 
     def __words_spoken(self, name):
         name = name.lower()
         if name not in self._people:
             raise Exception("Invalid name passed")
-        num = 0
-        for person, msg, date in self._convo:
-            if person == name:
-                num += len(msg.split())
-        return num
+        return self._person_stats()[name]['words'] if name in self._person_stats() else 0
 
     def __ave_words_per_person(self):
-        words = []
-        for name in self._people:
-            msgs = float(self.__msgs_spoken(name))
-            tot_words = float(self.__words_spoken(name))
-            if msgs > 0:
-                words.append((name, tot_words / msgs))
+        stats = self._person_stats()
         res = Counter()
-        for name, ave in words:
-            res[name] = ave
+        for name in self._people:
+            if name in stats:  # everyone in stats has sent at least one message
+                res[name] = stats[name]['words'] / stats[name]['messages']
         return res
 
     def __ave_words(self, name):
         name = name.lower()
         if name not in self._people:
             return -1
-        if self.__msgs_spoken(name) == 0:
+        if name not in self._person_stats():
             return 0
-        return self.__words_spoken(name) / self.__msgs_spoken(name)
+        return self._person_stats()[name]['words'] / self._person_stats()[name]['messages']
 
     def _assert_contact(self, contact):
         assert type(contact) in [type(None), str, list], "Contact must be of type string or a list of strings"
@@ -641,3 +853,27 @@ class BaseConvoReader:
     def __iter__(self):
         return (message for message in self._convo)
 
+
+class ConvoRows(Sequence):
+    """A read only view of a conversation's sender, message and date columns as [person, message, date] rows, built
+    when a row is accessed so that message text is only decoded for the rows that are actually used
+    """
+
+    def __init__(self, senders, messages, dates):
+        self._senders = senders
+        self._messages = messages
+        self._dates = dates
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return [self._senders[index], self._messages[index], self._dates[index]]
+
+    def __iter__(self):
+        return (list(row) for row in zip(self._senders, self._messages, self._dates))
+
+    def __len__(self):
+        return len(self._senders)
+
+    def __repr__(self):
+        return repr(list(self))
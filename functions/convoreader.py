@@ -464,12 +464,12 @@ class ConvoReader(BaseConvoReader):
             print("The start date of the conversation must be before the end date")
             return
 
+        # msgs_freq has an element for every day from the first message on, so dates can be found by their distance
         start_index, end_index = 0, len(msgs_freq)
-        for i in range(end_index):
-            if msgs_freq[i][0].date == start.date:
-                start_index = i
-            if msgs_freq[i][0].date == end.date:
-                end_index = i + 1
+        if 0 <= start - msgs_freq[0][0] < len(msgs_freq):
+            start_index = start - msgs_freq[0][0]
+        if 0 <= end - msgs_freq[0][0] < len(msgs_freq):
+            end_index = end - msgs_freq[0][0] + 1
 
         max_msgs = max(msgs_freq, key=lambda x: x[1])[1]
         value = max_msgs / 50
@@ -917,7 +917,7 @@ class ConvoReader(BaseConvoReader):
 
         max_len_index = len('{0:,}'.format(end + 1)) + 2
         for i in range(start - 1, end):
-            if self._convo[i - 1][2].distance_from(self._convo[i][2]) < -self._preferences['global']['threshold']:
+            if self._times[i - 1] - self._times[i] < -self._preferences['global']['threshold']:
                 print()
             print('{0:,}'.format(i + 1) + ' ' * (max_len_index - len('{0:,}'.format(i + 1))), end="")
             self._print_message(i)
@@ -959,16 +959,16 @@ class ConvoReader(BaseConvoReader):
 
         if start is not None:
             start = CustomDate.from_date_string(start) if isinstance(start, str) else start
-            assert start.date >= self._convo[0][2].date, \
-                "Your conversations only begin after {0}".format(self._convo[0][2].full_date)
-            start = CustomDate.bsearch_index(self._convo, start, key=lambda x: x[2])
+            assert start.date >= self._dates[0].date, \
+                "Your conversations only begin after {0}".format(self._dates[0].full_date)
+            start = CustomDate.bsearch_index(self._dates, start)
         else:
             start = 0
         if end is not None:
             end = CustomDate.from_date_string(end).plus_x_days(1) if isinstance(end, str) else end
-            assert end.date <= self._convo[-1][2].date, \
-                "Your conversations ends on {0}".format(self._convo[-1][2].full_date)
-            end = CustomDate.bsearch_index(self._convo, end, key=lambda x: x[2])
+            assert end.date <= self._dates[-1].date, \
+                "Your conversations ends on {0}".format(self._dates[-1].full_date)
+            end = CustomDate.bsearch_index(self._dates, end)
         else:
             end = len(self._convo)
 
@@ -1,5 +1,6 @@
 from math import ceil
 from datetime import date, timedelta
+from collections.abc import Sequence
 import re
 
 
@@ -13,6 +14,11 @@ class CustomDate():
     WEEK_INDEXES_TO_DAY_OF_WEEK = {0: "Monday", 1: "Tuesday", 2: "Wednesday",
                                    3: "Thursday", 4: "Friday", 5: "Saturday", 6: "Sunday"}
 
+    EPOCH = date(1970, 1, 1)  # dates are stored as minutes since 12:00am of this day, in the local time of each date
+    EPOCH_ORDINAL = EPOCH.toordinal()
+
+    __slots__ = ('full_date', 'week_day', 'time', 'time_zone', 'date', '_minutes', '_key')
+
     def __init__(self, date_str):
         """Constructor for CustomDate object. has following fields:
         String full_date   : the full date of this object, e.g. Wednesday, April 13, 2016 at 11:54pm PDT
@@ -21,6 +27,8 @@ class CustomDate():
         String time_zone   : the time zone e.g. PDT
         datetime.date date : a date object representation of the year, month and day
             e.g. datetime.date(2016, 4, 13)
+        The minutes past midnight and the minutes since CustomDate.EPOCH are computed once here, and the latter is
+        used as the key for all comparisons
         """
         if type(date_str) is type(self):
             date_str = date_str.full_date
@@ -28,9 +36,18 @@ class CustomDate():
         temp = date_str.split(',')
         self.week_day = temp[0]
         month, day_of_month = temp[1].split()
-        year, _, self.time, self.time_zone = date_str.split(',')[2].split()
+        year, _, self.time, self.time_zone = temp[2].split()
 
-        self.date = date(int(year), int(CustomDate.MONTHS_TO_INDEXES[month]), int(day_of_month))
+        self.date = date(int(year), CustomDate.MONTHS_TO_INDEXES[month], int(day_of_month))
+
+        minutes = CustomDate.TIMES_TO_MINUTES.get(self.time)
+        if minutes is None:  # not written the way minutes_to_time writes times, e.g. 09:05am
+            hours, minutes = self.time[:-2].split(':')
+            minutes = (int(hours) % 12) * 60 + int(minutes)
+            if self.time[-2:] == 'pm':
+                minutes += 12 * 60
+        self._minutes = minutes
+        self._key = (self.date.toordinal() - CustomDate.EPOCH_ORDINAL) * 24 * 60 + minutes
 
     @classmethod
     def from_date(cls, date_obj: date):
@@ -52,6 +69,28 @@ class CustomDate():
             year)
         return cls(date_string)
 
+    @classmethod
+    def from_epoch_minutes(cls, minutes: int, time_zone: str):
+        """Alternative constructor using the number of minutes since 12:00am on CustomDate.EPOCH, the inverse of
+        epoch_minutes(), and the time zone string (e.g. PDT)
+        """
+        # every field is already known, so the date string is built rather than parsed
+        res = cls.__new__(cls)
+        res.date = CustomDate.EPOCH + timedelta(days=minutes // (24 * 60))
+        res.week_day = CustomDate.WEEK_INDEXES_TO_DAY_OF_WEEK[res.date.weekday()]
+        res.time = CustomDate.minutes_to_time(minutes % (24 * 60))
+        res.time_zone = time_zone
+        res.full_date = "{0}, {1} {2}, {3} at {4} {5}".format(
+            res.week_day,
+            CustomDate.MONTH_INDEXES_TO_MONTHS[res.date.month],
+            res.date.day,
+            res.date.year,
+            res.time,
+            time_zone)
+        res._minutes = minutes % (24 * 60)
+        res._key = minutes
+        return res
+
     @classmethod
     def from_date_string(cls, date_string: str):
         """Alternative constructor using a date string in the form '{month}/{day}/{year}'"""
@@ -74,18 +113,17 @@ class CustomDate():
         return self.date.year
 
     def minutes(self) -> int:
-        minutes = self.time[:-2]
-        minutes = (int((minutes[:minutes.find(':')])) % 12) \
-                  * 60 + int(minutes[minutes.find(':') + 1:])
-        if 'pm' in self.time:
-            minutes += 12 * 60
-        return minutes
+        return self._minutes
+
+    def epoch_minutes(self) -> int:
+        """Returns the number of minutes between 12:00am on CustomDate.EPOCH and this date, ignoring time zones"""
+        return self._key
 
     def distance_from(self, other) -> int:
         """Returns the number of minutes ahead of other self is.
         If self is an earlier time result will be negative"""
         assert isinstance(other, CustomDate), "You must pass a valid CustomDate object"
-        return (self.minutes() - other.minutes()) + (self - other) * 24 * 60
+        return self._key - other._key
 
     @staticmethod
     def minutes_to_time(minutes: int) -> str:
@@ -103,6 +141,9 @@ class CustomDate():
             mins = '0' + mins
         return "{0}:{1}{2}".format(hours, mins, 'pm' if minutes >= 12 * 60 else 'am')
 
+    # minutes past midnight of every time string, filled in below the class
+    TIMES_TO_MINUTES = dict()
+
     def plus_x_days(self, days):
         assert isinstance(days, int), "days must be an integer"
         return CustomDate.from_date(self + days)
@@ -178,47 +219,50 @@ class CustomDate():
     def __eq__(self, other):
         if not isinstance(other, CustomDate):
             return False
-        return self.date == other.date and self.minutes() == other.minutes()
+        return self._key == other._key
 
     def __hash__(self):
-        return hash(self.full_date)
+        # consistent with __eq__, which ignores time zones
+        return hash(self._key)
 
     def __lt__(self, other):
         if type(other) is not type(self):
             return NotImplemented
-        if self.date < other.date:
-            return True
-        elif self.date == other.date:
-            if self.minutes() < other.minutes():
-                return True
-        return False
+        return self._key < other._key
 
     def __le__(self, other):
         if type(other) is not type(self):
             return NotImplemented
-        if self.date < other.date:
-            return True
-        elif self.date == other.date:
-            if self.minutes() <= other.minutes():
-                return True
-        return False
+        return self._key <= other._key
 
     def __gt__(self, other):
         if type(other) is not type(self):
             return NotImplemented
-        if self.date > other.date:
-            return True
-        elif self.date == other.date:
-            if self.minutes() > other.minutes():
-                return True
-        return False
+        return self._key > other._key
 
     def __ge__(self, other):
         if type(other) is not type(self):
             return NotImplemented
-        if self.date > other.date:
-            return True
-        elif self.date == other.date:
-            if self.minutes() >= other.minutes():
-                return True
-        return False
+        return self._key >= other._key
+
+
+CustomDate.TIMES_TO_MINUTES.update((CustomDate.minutes_to_time(minutes), minutes) for minutes in range(24 * 60))
+
+
+class EpochDates(Sequence):
+    """A sequence of CustomDate objects backed by an array of minutes since 12:00am on CustomDate.EPOCH and an array
+    of codes indexing a list of time zone names. Each CustomDate is only created when it is accessed
+    """
+
+    def __init__(self, times, time_zones, zone_names):
+        self._times = times
+        self._time_zones = time_zones
+        self._zone_names = zone_names
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return CustomDate.from_epoch_minutes(self._times[index], self._zone_names[self._time_zones[index]])
+
+    def __len__(self):
+        return len(self._times)
@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import mmap
+from collections.abc import MutableSequence
+
+
+class DataJson:
+    """Reads a data.json file saved by a previous version of setup.py without parsing all of it up front.
+
+    Opening the file memory maps it and finds where each conversation's list of messages starts and ends, which only
+    needs the brackets and quotes of each message rather than building it. The footer and preferences are parsed, and
+    each conversation is only parsed the first time it is used (see JsonConversation), so startup doesn't hold both the
+    text of the file and every parsed message in memory.
+
+    Files written with json.dumps' default separators (as setup.py and setup_functions.write_data_json do) have each
+    conversation matched by a single regex. Any other valid json is still read, just more slowly
+    """
+    PATH = 'data/data.json'
+
+    # a json string, and a conversation as written by json.dumps: a list of [person, message, date-time] lists, with
+    # the last message as group 1
+    STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+    MESSAGE = rb'\[' + STRING + rb', ' + STRING + rb', ' + STRING + rb'\]'
+    CONVERSATION = re.compile(rb'\[(?:(?:' + MESSAGE + rb', )*(' + MESSAGE + rb'))?\]', re.S)
+    TOKEN = re.compile(STRING + rb'|[\[\]{}]', re.S)
+    SCALAR = re.compile(rb'[^,\]} \t\n\r]+')  # a number, true, false or null
+    WHITESPACE = re.compile(rb'[ \t\n\r]*')
+
+    def __init__(self, path=PATH):
+        self.path = path
+        with open(path, mode='rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:  # empty files can't be memory mapped
+                raise ValueError("{0} is empty".format(path))
+            # the mapping stays valid after the file is closed, and after data.json is replaced with a new file
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._conversations = dict()  # name -> (start, end) byte offsets of its list of messages
+        self._last_messages = dict()  # name -> byte offset of its last message, for conversations matched by a regex
+        all_data = dict()
+        members, _ = self._members(self._skip_whitespace(0), self._top_level_end)
+        for key, start, end in members:
+            if key != 'conversation_data':
+                all_data[key] = self._parse(start, end)
+        self.footer = all_data['footer']
+        self.preferences = all_data['preferences']
+
+    # --------------------------------------------------   SCANNING   ------------------------------------------------ #
+
+    def _members(self, pos, value_end):
+        """Returns the tuple (members, end) for the json object starting at pos, where members is a list of
+        (key, start, end) for each of its members, with start and end the byte offsets of the value, and end is the byte
+        offset just after the object. The end of each value is found with value_end(key, start)
+        """
+        assert self._buffer[pos:pos + 1] == b'{', "Expected a json object at byte {0} of {1}".format(pos, self.path)
+        members = []
+        pos = self._skip_whitespace(pos + 1)
+        if self._buffer[pos:pos + 1] == b'}':
+            return members, pos + 1
+        while True:
+            key_end = self._value_end(pos)
+            key = self._parse(pos, key_end)
+            pos = self._skip_whitespace(key_end)
+            assert self._buffer[pos:pos + 1] == b':', "Expected ':' at byte {0} of {1}".format(pos, self.path)
+            start = self._skip_whitespace(pos + 1)
+            end = value_end(key, start)
+            members.append((key, start, end))
+
+            pos = self._skip_whitespace(end)
+            if self._buffer[pos:pos + 1] == b'}':
+                return members, pos + 1
+            assert self._buffer[pos:pos + 1] == b',', "Expected ',' or '}}' at byte {0} of {1}".format(pos, self.path)
+            pos = self._skip_whitespace(pos + 1)
+
+    def _top_level_end(self, key, start):
+        if key != 'conversation_data':
+            return self._value_end(start)
+        members, end = self._members(start, self._conversation_end)
+        for name, convo_start, convo_end in members:
+            self._conversations[name] = (convo_start, convo_end)
+        return end
+
+    def _conversation_end(self, name, start):
+        match = DataJson.CONVERSATION.match(self._buffer, start)
+        if match is None:
+            return self._value_end(start)
+        if match.group(1) is not None:
+            self._last_messages[name] = match.start(1)
+        return match.end()
+
+    def _value_end(self, pos):
+        """Returns the byte offset just after the json value starting at pos"""
+        if self._buffer[pos:pos + 1] not in (b'"', b'[', b'{'):
+            return DataJson.SCALAR.match(self._buffer, pos).end()
+        depth = 0
+        for token in DataJson.TOKEN.finditer(self._buffer, pos):
+            if token.group() in (b'[', b'{'):
+                depth += 1
+            elif token.group() in (b']', b'}'):
+                depth -= 1
+            if depth == 0:
+                return token.end()
+        raise ValueError("{0} ends in the middle of a json value".format(self.path))
+
+    def _skip_whitespace(self, pos):
+        return DataJson.WHITESPACE.match(self._buffer, pos).end()
+
+    def _parse(self, start, end):
+        return json.loads(self._buffer[start:end].decode('utf-8'))
+
+    # --------------------------------------------------   SCANNING   ------------------------------------------------ #
+
+    def names(self) -> list:
+        """Returns the names of all conversations in the file"""
+        return list(self._conversations.keys())
+
+    def conversation(self, name):
+        """Returns a JsonConversation for the conversation name. Nothing is parsed until it is used"""
+        length = self.preferences['length'].get(name, (None, None))[1]
+        return JsonConversation(self, *self._conversations[name], length=length,
+                                last_message=self._last_messages.get(name))
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def __repr__(self):
+        return "DataJson({0})".format(repr(self.path))
+
+
+class JsonConversation(MutableSequence):
+    """A conversation in a data.json file read with DataJson. Behaves like the list of [person, message, date-time]
+    messages json.load would give, but the messages are only parsed (and then kept) the first time they are needed.
+    The length and first and last messages are known without parsing the rest
+    """
+
+    def __init__(self, data_json, start, end, length=None, last_message=None):
+        self._data_json = data_json
+        self._start, self._end = start, end
+        self._len = length  # from the file's preferences, if they have it
+        self._last_message = last_message  # the byte offset of the last message, if the file was scanned for it
+        self._messages = None
+
+    def _load(self) -> list:
+        if self._messages is None:
+            self._messages = self._data_json._parse(self._start, self._end)
+            self._len = len(self._messages)
+        return self._messages
+
+    def __getitem__(self, index):
+        # the first message is needed for every conversation when a MessageReader starts, and the last one to sort
+        # conversations by when they were last contacted
+        if self._messages is None and index == 0:
+            start = self._data_json._skip_whitespace(self._start + 1)
+            if self._data_json._buffer[start:start + 1] == b'[':
+                return self._data_json._parse(start, self._data_json._value_end(start))
+        elif self._messages is None and index == -1 and self._last_message is not None:
+            return self._data_json._parse(self._last_message, self._data_json._value_end(self._last_message))
+        return self._load()[index]
+
+    def json(self) -> str:
+        """Returns the conversation as json, copied from the file if it hasn't been parsed (so it can't have changed)"""
+        if self._messages is None:
+            return self._data_json._buffer[self._start:self._end].decode('utf-8')
+        return json.dumps(self._messages)
+
+    def __setitem__(self, index, value):
+        self._load()[index] = value
+
+    def __delitem__(self, index):
+        del self._load()[index]
+
+    def insert(self, index, value):
+        self._load().insert(index, value)
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        if self._len is None:
+            self._load()
+        return self._len if self._messages is None else len(self._messages)
+
+    def __repr__(self):
+        return "<JsonConversation of {0:,} messages{1}>".format(len(self), "" if self._messages is None else ", loaded")
@@ -1,3 +1,6 @@
+import re
+from collections import Counter
+
 import functions.emoji_values
 
 
@@ -7,6 +10,30 @@ UNICODE_EMOJI = functions.emoji_values.UNICODE_EMOJI
 SRC_CODES_TO_CAP_NAME = functions.emoji_values.SRC_CODES_TO_CAP_NAME
 NAMES_TO_CODES = functions.emoji_values.NAMES_TO_CODES
 
+VARIATION_SELECTOR = '\ufe0f'  # asks for the emoji rather than text presentation of the character before it
+ZERO_WIDTH_JOINER = '\u200d'  # joins emojis into one, e.g. family emojis
+SKIN_TONES = set(chr(code) for code in range(0x1F3FB, 0x1F3FF + 1))
+
+
+def _build_emoji_trie():
+    """Returns a trie of the emojis in UNICODE_EMOJI, as nested dictionaries of characters. A '' key marks the end of
+    an emoji. Spaces in the table's keys (e.g. in keycaps and a flag) are left out, since they don't appear in emojis
+    """
+    trie = dict()
+    for emoji in UNICODE_EMOJI:
+        node = trie
+        for char in emoji.replace(' ', ''):
+            node = node.setdefault(char, dict())
+        node[''] = True
+    return trie
+
+
+EMOJI_TRIE = _build_emoji_trie()
+# the characters an emoji can start with. Every character outside the basic multilingual plane is included as a single
+# range, which keeps the character set fast to search and covers facebook's private use emoji codes
+EMOJI_START = re.compile('[' + ''.join(re.escape(char) for char in sorted(EMOJI_TRIE) if ord(char) <= 0xFFFF) +
+                         '\U00010000-\U0010FFFF]')
+
 def underscores_to_caps(string):
     return string.upper().replace('_', ' ')
 
@@ -17,12 +44,75 @@ def caps_to_underscores(string):
 
 def emojify(message):
     """Replaces python src codes with their corresponding emoji, if found"""
-    if '\\' in repr(message):
-        for key in SRC_CODES_TO_CAP_NAME:
-            message = message.replace(key, src_to_emoiji(key))
-    return message
+    if SRC_CODE.search(message) is None:  # most messages have no src codes, and are returned as they are
+        return message
+    return message.translate(SRC_CODES_TO_EMOJIS)
+
 
 
+def _match_emoji(text, start):
+    """Returns the index just past the longest emoji in EMOJI_TRIE starting at text[start], including a following
+    skin tone and variation selectors, or None if no emoji starts there"""
+    node, i, end = EMOJI_TRIE, start, None
+    while i < len(text):
+        if text[i] == VARIATION_SELECTOR and i > start:
+            i += 1
+            if end == i - 1:  # the selector belongs to the emoji just matched
+                end = i
+            continue
+        node = node.get(text[i])
+        if node is None:
+            break
+        i += 1
+        if '' in node:
+            end = i
+    if end is not None and end < len(text) and text[end] in SKIN_TONES and text[end - 1] not in SKIN_TONES:
+        end += 1
+        if end < len(text) and text[end] == VARIATION_SELECTOR:
+            end += 1
+    return end
+
+
+def _match_sequence(text, start):
+    """Returns the index just past the emoji starting at text[start], including any emojis joined to it with zero
+    width joiners, or None if no emoji starts there"""
+    end = _match_emoji(text, start)
+    while end is not None and end + 1 < len(text) and text[end] == ZERO_WIDTH_JOINER:
+        joined = _match_emoji(text, end + 1)
+        if joined is None:
+            break
+        end = joined
+    return end
+
+
+def count_emojis(messages) -> Counter:
+    """Returns a Counter of the emojis in messages, an iterable of strings, scanning each message once.
+    Emojis made of several characters (flags, keycaps, skin tones and zero width joiner sequences) are counted as one
+    emoji, with variation selectors removed so that e.g. the text and emoji presentations of a heart are counted
+    together. Facebook's private use codes are counted as the emojis they stand for, with src_to_emoiji()
+    """
+    found = Counter()
+    for msg in messages:
+        match = EMOJI_START.search(msg)
+        while match is not None:
+            start = match.start()
+            end = _match_sequence(msg, start)
+            if end is not None:
+                found[msg[start:end].replace(VARIATION_SELECTOR, '')] += 1
+            else:
+                end = start + 1
+                if '\\U000' in repr(msg[start]):
+                    found[msg[start]] += 1
+            match = EMOJI_START.search(msg, end)
+
+    res = Counter()
+    for key, val in found.most_common():  # codes are added in order of frequency, as when counting characters
+        if len(key) == 1 and '\\U000' in repr(key):
+            res[src_to_emoiji(key)] += val
+        else:
+            res[key] += val
+    return res
+
 
 def src_to_emoiji(code, safe=True):
     """Takes in a python src encoding in UTF8 of an emoji, and returns the emoji
@@ -52,3 +142,62 @@ def emoji_to_src(emoji, safe=True):
             return emoji
         else:
             raise e
+
+
+# translation table used by emojify(), made once so each message is converted in a single pass. Every replacement is an
+# emoji rather than another src code, so this gives the same result as replacing the codes one after another
+SRC_CODES_TO_EMOJIS = {ord(code): src_to_emoiji(code) for code in SRC_CODES_TO_CAP_NAME
+                       if src_to_emoiji(code) != code}
+
+
+def _character_ranges(codes):
+    """Returns a regex character set matching the code points in codes, written as ranges of consecutive code points.
+    Long lists of single characters outside the basic multilingual plane make re check each one in turn"""
+    ranges = []
+    for code in sorted(codes):
+        if ranges and ranges[-1][1] == code - 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    return '[' + ''.join(re.escape(chr(low)) + '-' + re.escape(chr(high)) for low, high in ranges) + ']'
+
+
+SRC_CODE = re.compile(_character_ranges(SRC_CODES_TO_EMOJIS))
+
+
+if __name__ == '__main__':
+    # benchmark emojify against replacing each src code in turn, run with `python3 -m functions.emojis [num_messages]`
+    import sys
+    import time
+    import random
+
+    def emojify_each_code(message):
+        if '\\' in repr(message):
+            for key in SRC_CODES_TO_CAP_NAME:
+                message = message.replace(key, src_to_emoiji(key))
+        return message
+
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(0)
+    codes = sorted(SRC_CODES_TO_CAP_NAME)
+    words = ['hey', 'what', 'are', 'you', 'up', 'to', 'lol', 'see', 'you', 'tonight', 'pizza', '😀', 'ok!', "it's"]
+    messages = []
+    for i in range(num_messages):
+        message = [random.choice(words) for _ in range(random.randint(1, 12))]
+        if i % 10 == 0:  # about one message in ten has src codes, as in older archives
+            message += [random.choice(codes) for _ in range(random.randint(1, 3))]
+            random.shuffle(message)
+        messages.append(' '.join(message))
+
+    start = time.time()
+    fast = [emojify(message) for message in messages]
+    fast_time = time.time() - start
+    print("emojify:                       {0:,} messages in {1:.2f} seconds".format(num_messages, fast_time))
+
+    sample = messages[:max(1, num_messages // 100)]  # replacing each code is too slow to run on every message
+    start = time.time()
+    slow = [emojify_each_code(message) for message in sample]
+    slow_time = (time.time() - start) * num_messages / len(sample)
+    print("replacing each code in turn:   {0:,} messages in about {1:.2f} seconds".format(num_messages, slow_time))
+    assert slow == fast[:len(sample)], "emojify gave different output"
+    print("outputs identical on the {0:,} messages compared".format(len(sample)))
@@ -0,0 +1,75 @@
+import heapq
+from collections import Counter
+from difflib import SequenceMatcher
+
+
+class FuzzySearch:
+    """Finds the messages similar to a query, by the ratio() of a difflib.SequenceMatcher(isjunk, query, message).
+
+    Building a SequenceMatcher and finding its matching blocks is slow, so messages are first ruled out with two upper
+    bounds on the ratio, the same ones SequenceMatcher's real_quick_ratio() and quick_ratio() compute:
+        length bound   2 * min(len(query), len(message)) / (len(query) + len(message))
+        count bound    2 * (characters the two have in common, counting repeats) / (len(query) + len(message))
+    The ratio can never be higher than either bound, so a message whose bound is below min_ratio can't match and the
+    results are exactly those of computing every ratio.
+    """
+
+    def __init__(self, query, junk=' '):
+        """Parameters:
+            query: the text to search for
+            junk (optional): a string in which each character is treated as "junk" by the SequenceMatcher
+        """
+        self.query = query
+        self._isjunk = lambda string: string in junk
+        self._counts = Counter(query)
+
+    @staticmethod
+    def _ratio(matches, length) -> float:
+        # the same formula SequenceMatcher uses, so that bounds and ratios compare exactly
+        return 2.0 * matches / length if length else 1.0
+
+    def length_bound(self, text) -> float:
+        return self._ratio(min(len(self.query), len(text)), len(self.query) + len(text))
+
+    def count_bound(self, text) -> float:
+        counts = Counter(text)
+        matches = sum(min(num, counts[char]) for char, num in self._counts.items())
+        return self._ratio(matches, len(self.query) + len(text))
+
+    def ratio(self, text) -> float:
+        return SequenceMatcher(self._isjunk, self.query, text).ratio()
+
+    def matches(self, texts, min_ratio=0.6) -> list:
+        """Returns a sorted list of the indexes of the strings in texts with a ratio of at least min_ratio"""
+        res = []
+        for i, text in enumerate(texts):
+            if self.length_bound(text) >= min_ratio and self.count_bound(text) >= min_ratio \
+                    and self.ratio(text) >= min_ratio:
+                res.append(i)
+        return res
+
+    def best(self, texts, num, min_ratio=0.0) -> list:
+        """Returns a list of the indexes of the (at most) num strings in texts with the highest ratios of at least
+        min_ratio, highest ratio first and earlier indexes first for equal ratios. Strings are checked in order of
+        their length bound, stopping as soon as no remaining string can beat the num-th best ratio found
+        """
+        assert isinstance(num, int) and num >= 0, "num must be a non-negative integer"
+        if num == 0:
+            return []
+        bounds = sorted(((self.length_bound(text), i) for i, text in enumerate(texts)), key=lambda x: (-x[0], x[1]))
+        best = []  # heap of (ratio, -index) for the num best strings so far, worst first
+        for bound, i in bounds:
+            floor = best[0][0] if len(best) == num else min_ratio
+            if bound < floor:
+                break
+            text = texts[i]
+            if self.count_bound(text) < floor:
+                continue
+            ratio = self.ratio(text)
+            if ratio < min_ratio:
+                continue
+            if len(best) < num:
+                heapq.heappush(best, (ratio, -i))
+            elif (ratio, -i) > best[0]:
+                heapq.heapreplace(best, (ratio, -i))
+        return [-neg_i for _, neg_i in sorted(best, reverse=True)]
@@ -11,8 +11,8 @@ class GUIConvoReader(BaseConvoReader):
     MAX_NUM_LAYERS = 5
     MAX_NUM_COLORS = 5
 
-    def __init__(self, convo_name, convo_list, download_date):
-        BaseConvoReader.__init__(self, convo_name, convo_list, 'gui')  # default value of gui for rank
+    def __init__(self, convo_name, convo_list, download_date, rank='gui'):
+        BaseConvoReader.__init__(self, convo_name, convo_list, rank)
         self._last_day = download_date
 
         self.people_by_messages = sorted(self.get_people(), key=lambda x: self.raw_messages(x), reverse=True)
@@ -211,6 +211,12 @@ class GUIConvoReader(BaseConvoReader):
             val.append([val[-1][0].plus_x_days(1), 0])
         if not cumulative:
             return val
+        elif forward_shift == 0:  # the running totals for each calendar day are already kept
+            contact = self._assert_contact(contact)
+            totals = [self._running_totals_by_day(person) for person in dict.fromkeys(contact or [None])]
+            for i in range(len(val)):
+                val[i][1] = sum(total[min(i + 1, len(total) - 1)] for total in totals)
+            return val
         else:
             for i in range(1, len(val)):
                 val[i][1] = val[i - 1][1] + val[i][1]
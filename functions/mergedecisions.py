@@ -0,0 +1,127 @@
+import os
+import json
+
+from functions.customdate import CustomDate
+
+
+class MergeDecisions:
+    """The decisions made during setup about whether two threads with the same name are parts of one conversation,
+    saved so that setup can be run again (or with --update) without asking about the same threads twice.
+
+    Each decision is saved as a dictionary with:
+        conversation    the name setup gave the conversation the thread might belong to
+        previous_end    the date of the last message of that conversation so far
+        next_start      the date of the first message of the thread
+        next_message    the text of the first message of the thread
+        same            whether the thread was added to the conversation
+        by              'user' if the user was asked, 'auto' if it was scored by auto_merge() and 'rule' if the thread
+                        was added without asking because it was split off of the conversation minutes after it ended
+        score           the score of the thread given by score()
+
+    Decisions are found again by the first four values, which don't change as newer archives add messages to the end
+    of conversations, and are replayed in place of asking the user or scoring the thread.
+
+    With auto merging on, a thread is scored instead of asking the user. Facebook splits a conversation into threads
+    of THREAD_LENGTH messages, so a thread can only continue a conversation if one of them is a whole thread's worth of
+    messages. The score is:
+        1                                           if the end of the conversation and the start of the thread overlap
+        CHUNK_WEIGHT * (either is a whole thread)   otherwise, plus
+        GAP_WEIGHT * (1 - gap / MAX_GAP)            where gap is the minutes between the two, at most MAX_GAP
+    and the thread is added to the conversation if the score is at least THRESHOLD
+    """
+
+    PATH = 'data/merge_decisions.json'
+    VERSION = 1
+
+    THREAD_LENGTH = 10000  # the number of messages in each thread of a conversation that's been split up
+    MAX_OVERLAP = 10  # the most messages checked for an overlap between the end of a conversation and a thread
+    MAX_GAP = 7 * 24 * 60  # minutes
+    CHUNK_WEIGHT = 0.5
+    GAP_WEIGHT = 0.5
+    THRESHOLD = 0.6
+
+    def __init__(self, decisions=None, auto_merge=False):
+        """Parameters:
+            decisions (optional): a list of decisions in the format saved, to replay
+            auto_merge (optional): (Boolean) whether threads without a decision are scored instead of asking the user
+        """
+        self.decisions = [] if decisions is None else decisions
+        self.auto_merge = auto_merge
+        self._by_key = {self._key(**decision): decision for decision in self.decisions}
+
+    @staticmethod
+    def _key(conversation, previous_end, next_start, next_message, **_):
+        return conversation, previous_end, next_start, next_message
+
+    def replay(self, name, previous, following):
+        """Returns whether following was found to be part of the conversation previous (named name) before, or None if
+        there is no decision saved for them
+        """
+        decision = self._by_key.get(self._key(name, previous[-1][2], following[0][2], following[0][1]))
+        return None if decision is None else decision['same']
+
+    def record(self, name, previous, following, same, by):
+        """Saves the decision that following is (if same is True) or isn't part of the conversation previous"""
+        decision = dict(conversation=name, previous_end=previous[-1][2], next_start=following[0][2],
+                        next_message=following[0][1], same=same, by=by, score=self.score(previous, following))
+        key = self._key(**decision)
+        if key in self._by_key:
+            self.decisions.remove(self._by_key[key])
+        self.decisions.append(decision)
+        self._by_key[key] = decision
+
+    def auto(self, name, previous, following) -> bool:
+        """Decides whether following is part of the conversation previous by its score, saving the decision"""
+        same = self.score(previous, following) >= MergeDecisions.THRESHOLD
+        self.record(name, previous, following, same, 'auto')
+        return same
+
+    @staticmethod
+    def score(previous, following) -> float:
+        """Returns the score between 0 and 1 of how likely the thread following is to continue the conversation
+        previous, both lists of (person, message, date-time string) messages
+        """
+        gap = CustomDate(following[0][2]).distance_from(CustomDate(previous[-1][2]))
+        if gap < 0:
+            return 0.0
+
+        # the same messages at the end of one and the start of the other. People are ignored since they can be
+        # renamed
+        def same_message(msg1, msg2):
+            return msg1[1] == msg2[1] and msg1[2] == msg2[2]
+        for length in range(min(MergeDecisions.MAX_OVERLAP, len(previous), len(following)), 0, -1):
+            if all(same_message(previous[len(previous) - length + i], following[i]) for i in range(length)):
+                return 1.0
+
+        whole_thread = len(following) == MergeDecisions.THREAD_LENGTH \
+            or len(previous) % MergeDecisions.THREAD_LENGTH == 0
+        return MergeDecisions.CHUNK_WEIGHT * whole_thread \
+            + MergeDecisions.GAP_WEIGHT * (1 - min(gap, MergeDecisions.MAX_GAP) / MergeDecisions.MAX_GAP)
+
+    # ---------------------------------------------   LOADING AND SAVING   ------------------------------------------- #
+
+    @classmethod
+    def load(cls, path=PATH, auto_merge=False):
+        """Returns the MergeDecisions saved at path, or one without any decisions if there isn't one saved by this
+        version
+        """
+        if not os.path.isfile(path):
+            return cls(auto_merge=auto_merge)
+        with open(path, mode='r', encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get('version') != cls.VERSION:
+            return cls(auto_merge=auto_merge)
+        return cls(saved['decisions'], auto_merge=auto_merge)
+
+    def save(self, path=PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'decisions': self.decisions}, f, indent=1)
+
+    # ---------------------------------------------   LOADING AND SAVING   ------------------------------------------- #
+
+    def __len__(self):
+        return len(self.decisions)
+
+    def __repr__(self):
+        return "<MergeDecisions of {0:,} decisions{1}>".format(len(self), ", auto merging" if self.auto_merge else "")
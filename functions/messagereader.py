@@ -1,38 +1,61 @@
 from collections import Counter
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import shutil
 import os
 import random
 import ast
 import inspect
 import re
-import json
 
 from colorama import Fore, Back, Style, init
 
 from functions.setup_functions import (
-    PreferencesSearcher, clear_screen, user_says_yes, fit_colored_text_to_console, one_line, data_as_json
+    PreferencesSearcher, clear_screen, user_says_yes, fit_colored_text_to_console, one_line, save_data_json
 )
 from functions.baseconvoreader import BaseConvoReader
 from functions.convoreader import ConvoReader, color_method, get_user_choice_from_range
 from functions.guiconvoreader import GUIConvoReader
 from functions.customdate import CustomDate
+from functions.messagestore import MessageStore, StoredConversation
+from functions.datajson import DataJson
+from functions.aggregateindex import AggregateIndex
+import functions.emojis as emojis
 
 init(autoreset=True)
 
 
 class MessageReader:
 
-    def __init__(self, preload_conversations=False):
-        with open('data/data.json', mode='r', encoding='UTF8') as f:
+    def __init__(self, preload_conversations=False, workers=1):
+        """Parameters:
+            preload_conversations (optional): (Boolean) Whether to build a ConvoReader for every conversation up front
+            workers (optional): (int) The number of processes that totals over every conversation (e.g. raw_emojis())
+                                are split among when they can't be read from the aggregate index. Defaults to 1, which
+                                runs them in this process
+        """
+        assert isinstance(workers, int) and workers >= 1, "workers must be a positive integer"
+        self.workers = workers
+        if MessageStore.exists():
+            # conversations are read from the store as they are used
+            self._store = MessageStore()
+            self.data = {name: self._store.conversation(name) for name in self._store.names()}
+            all_data = {'footer': self._store.footer, 'preferences': self._store.preferences}
+        else:
+            # data saved by a previous version of setup.py, see functions/messagestore.py to migrate it. Conversations
+            # are parsed from it as they are used
+            self._store = None
             try:
-                all_data = f.read()
+                data_json = DataJson()
             except Exception as e:
-                print(Fore.LIGHTRED_EX + Back.BLACK + "An error occurred when reading in your data file. Please make "
-                                                      "sure setup.py finished properly" + Style.RESET_ALL)
+                print(Fore.LIGHTRED_EX + Back.BLACK + "An error occurred when reading in your data file. Please "
+                                                      "make sure setup.py finished properly" + Style.RESET_ALL)
                 raise e
-
-        all_data = json.loads(all_data)
-        self.data = all_data['conversation_data']
+            self.data = {name: data_json.conversation(name) for name in data_json.names()}
+            all_data = {'footer': data_json.footer, 'preferences': data_json.preferences}
         self.download = all_data['footer']
 
         tmp_preference = all_data['preferences']
@@ -49,6 +72,8 @@ class MessageReader:
         self.download_date = CustomDate(" ".join(self.download.split()[-7:]))
         self.first_chat_date = self._get_first_chat_date()
         self._edits = []
+        self._edited_names = set()  # names of conversations edited since they were last saved
+        self._aggregate_index = None  # loaded the first time it's needed, see _aggregates()
 
         self.convo_readers = {}
         if preload_conversations:
@@ -127,7 +152,47 @@ class MessageReader:
         assert isinstance(index, int), "index needs to be an integer"
         assert 0 < index <= len(self), "Index out of bounds, index must be between 1 and {0}".format(len(self))
 
-        return GUIConvoReader(self.names[index - 1], self.data[self.names[index - 1]], self.download_date)
+        return GUIConvoReader(self.names[index - 1], self.data[self.names[index - 1]], self.download_date, index)
+
+    def scan_conversations(self, person=None):
+        """Yields the tuple (name, senders, messages, times) for each conversation, in the order of self.names, where
+        senders is a list of lower case names, messages a sequence of the text of each message and times the minutes
+        since CustomDate.EPOCH each message was sent. Conversations are read straight from self.data without building
+        (or caching) ConvoReaders, so this is the cheap way to total something over every conversation
+        Parameters:
+            person (optional): (str) the name of a person, to only scan conversations they are in
+        """
+        person = None if person is None else person.lower()
+        for name in self.names:
+            columns = _scan_conversation(self.data, name, person)
+            if columns is not None:
+                yield (name,) + columns
+
+    def _map_conversations(self, function, *args, person=None, workers=None):
+        """Returns a list of function(name, senders, messages, times, *args) for each conversation yielded by
+        scan_conversations(person), in the same order. function must be defined at the top level of this module.
+        If workers (defaulting to self.workers) is greater than 1 conversations are split among a pool of that many
+        processes. The pool needs the 'fork' start method, so workers can read self.data without it being copied to
+        them, and on platforms without it (Windows) conversations are scanned in this process
+        """
+        global _pool_data
+        workers = self.workers if workers is None else workers
+        assert isinstance(workers, int) and workers >= 1, "workers must be a positive integer"
+        if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            return [function(*columns, *args) for columns in self.scan_conversations(person=person)]
+
+        _pool_data = self.data
+        try:
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                # a few chunks per process, so uneven conversations still keep every process busy
+                chunksize = max(1, len(self.names) // (workers * 4))
+                results = executor.map(_apply_to_conversation, repeat(function), self.names,
+                                       repeat(None if person is None else person.lower()), repeat(args),
+                                       chunksize=chunksize)
+                return [result for result in results if result is not None]
+        finally:
+            _pool_data = None
 
     def random(self):
         """Returns a random conversation"""
@@ -261,12 +326,17 @@ class MessageReader:
                 return
 
         # The block below updates the List<tuple> for the self.data value of the dictionary
-        for i in range(len(previous_data)):
-            person, msg, date = previous_data[i]
-            if person.lower() == old_name:
-                previous_data[i] = tuple([self.custom_title(new_name), msg, date])
+        if isinstance(previous_data, StoredConversation):
+            previous_data.replace_person(old_name, self.custom_title(new_name))
+        else:
+            for i in range(len(previous_data)):
+                person, msg, date = previous_data[i]
+                if person.lower() == old_name:
+                    previous_data[i] = tuple([self.custom_title(new_name), msg, date])
 
         self._edits.append(self.raw_rank(previous_name))
+        self._edited_names.discard(previous_name)
+        self._edited_names.add(updated_name)
         del self.data[previous_name]  # deletes the old data from self.data
         del self.convo_readers[previous_name]  # deletes the old convoreader from the cache
         self.data[updated_name] = previous_data  # updates self.data with the new data
@@ -325,9 +395,16 @@ class MessageReader:
             if os.path.isfile(path):
                 shutil.rmtree(path)
 
-        data = data_as_json(self.data, self.download, PreferencesSearcher.from_msgs_dict(self.data).preferences)
-        with open('data/data.json', mode='w', encoding='utf-8') as f:
-            f.write(data)
+        preferences = PreferencesSearcher.from_msgs_dict(self.data).preferences
+        if self._store is not None:
+            self._store.save(self.data, self.download, preferences)
+        else:
+            save_data_json('data/data.json', self.data, self.download, preferences)
+
+        previous = self._aggregate_index if self._aggregate_index is not None else AggregateIndex.load()
+        self._aggregate_index = AggregateIndex.build(self.data, previous=previous, changed=self._edited_names)
+        self._aggregate_index.save()
+        self._edited_names = set()
 
     def save_subset_of_data(self, conversation_names, file_name, skip_messages=False):
         """Saves to a file the data for the conversations specified
@@ -369,10 +446,7 @@ class MessageReader:
             download = self.download
             quick_settings = PreferencesSearcher.from_msgs_dict(new_data)
 
-            writable_data = data_as_json(new_data, download, quick_settings)
-
-            with open(file_name, mode='w', encoding='utf-8') as f:
-                f.write(writable_data)
+            save_data_json(file_name, new_data, download, quick_settings.preferences)
         except AssertionError as e:
             print(e)
             return
@@ -756,7 +830,7 @@ class MessageReader:
             print("{0}{1} - {2:,}".format(' ' * (MAX_INT_LEN - len(str(i))), convo, freq))
             i += 1
 
-    def raw_top_conversations(self, start=None, end=None):
+    def raw_top_conversations(self, start=None, end=None, workers=None):
         """Returns a Counter object holding the names of conversations mapped to their message frequency
         in a time period
         Parameters:
@@ -764,24 +838,27 @@ class MessageReader:
                             "{month}/{day}/{year}". Defaults to the first date messages were sent
             end (optional): (str) A date string for the end of the desired period, in the same form as start.
                             Defaults to the download date
+            workers (optional): (int) The number of processes to scan conversations with, defaulting to self.workers
         Return:
             a Counter object with keys being the title case names of conversations and values being the number of
               messages sent during the specified period
         """
         CustomDate.assert_dates(start, end)
-        start = CustomDate.from_date_string(start) if start is not None else self.first_chat_date
-        end = CustomDate.from_date_string(end).plus_x_days(1) if end is not None else self.download_date
+        index = self._aggregates()
+        if index is not None:
+            first = CustomDate.from_date_string(start) if start is not None else self.first_chat_date
+            last = CustomDate.from_date_string(end) if end is not None else self.download_date
+            rankings = index.messages_between(first.epoch_minutes() // (24 * 60), last.epoch_minutes() // (24 * 60),
+                                              names=self.names)
+            return Counter({name.title(): count for name, count in rankings.items()})
+
+        end = end if end is not None else self.download_date.to_string()
+        # the messages sent from 12:00am of start until 12:00am the day after end, as counted by raw_msgs_between()
+        low = None if start is None else CustomDate.from_date_string(start).epoch_minutes()
+        high = CustomDate.from_date_string(end).epoch_minutes() + 24 * 60
         rankings = Counter()
-
-        for i in range(len(self)):
-            convo = self.get_convo(i + 1)
-            name = convo._name.title()
-            rankings[name] = 0
-            if start < convo[-1][2] and end > convo[0][2]:  # if the range we want overlaps with this conversation
-                for person, msg, date in convo:
-                    if start <= date <= end:
-                        rankings[name] += 1
-
+        for name, count in self._map_conversations(_messages_between, low, high, workers=workers):
+            rankings[name.lower().title()] = count
         return rankings
 
     def emoijs(self, only_me=False, limit=10):
@@ -798,22 +875,23 @@ class MessageReader:
             print(e)
             return
 
-    def raw_emojis(self, only_me=False):
+    def raw_emojis(self, only_me=False, workers=None):
         """Returns the total raw_emojis in an aggregate sum of all your conversations
             Parameters:
                 only_me (optional): Considers only your sent messages if True, otherwise both your sent and received
+                workers (optional): (int) The number of processes to scan conversations with, defaulting to
+                                    self.workers
             Return:
                 Counter object storing your emojis frequencies
         """
+        index = self._aggregates()
+        if index is not None:
+            return index.emojis(person=self.person.lower() if only_me else None, names=self.names)
+
+        person = self.person.lower() if only_me else None
         res = Counter()
-        for i in range(1, len(self) + 1):
-            try:
-                if only_me:
-                    res += self.get_convo(i).raw_emojis(person=self.person)
-                else:
-                    res += self.get_convo(i).raw_emojis()
-            except AssertionError:
-                pass
+        for counts in self._map_conversations(_emojis_sent, person, person=person, workers=workers):
+            res += counts
         return res
 
     def messages_graph(self, only_me=False, forward_shift=0, start=None, end=None):
@@ -883,7 +961,7 @@ class MessageReader:
                 print('#' * int(msgs_freq[i][1] / value))
         print()
 
-    def raw_messages_graph(self, only_me=False, forward_shift=0, start=None, end=None):
+    def raw_messages_graph(self, only_me=False, forward_shift=0, start=None, end=None, workers=None):
         """Returns a list representing the data for aggregate messaging totals by day for every day from the date your
         first message was sent to data's download date
         Parameters:
@@ -893,6 +971,7 @@ class MessageReader:
                                        for the previous day
             start (optional): (str|None) a date string representing the start date in the form "{month}/{day}/{year}"
             end (optional): (str|None) a date string for the end date, in the same format as start
+            workers (optional): (int) The number of processes to scan conversations with, defaulting to self.workers
         Return:
             A list of tuples with a CustomDate in element 0 and the integer number of messages for that day in element 1
         """
@@ -912,23 +991,32 @@ class MessageReader:
         else:
             contact = None
 
-        for i in range(1, len(self) + 1):
-            try:
-                messages_data = self.get_convo(i).raw_msgs_graph(contact=contact, forward_shift=forward_shift)
-                total.update({key: val for key, val in messages_data})
-            except AssertionError:
-                pass
+        index = self._aggregates()
+        if index is not None and forward_shift == 0:  # the index counts messages by calendar day
+            return index.messages_by_day(person=contact)[start_index: end_index]
+
+        assert isinstance(forward_shift, int), "Forward shift must be an integer"
+        assert -60 * 24 < forward_shift < 60 * 24, "Forward shift must be between {0} and {1}, not including them" \
+            .format(-60 * 24, 60 * 24)
+        for days in self._map_conversations(_messages_by_day, contact, forward_shift, person=contact, workers=workers):
+            total.update(days)
 
-        result = sorted(total.most_common(), key=lambda x: x[0])
+        result = [(CustomDate.from_date(CustomDate.EPOCH + timedelta(days=day)), total[day]) for day in sorted(total)]
         return result[start_index: end_index]
 
-    def raw_facebook_names(self):
-        """Returns a list of all facebook names in chats, e.g. 10232342934@facebook.com, but with a working number"""
+    def raw_facebook_names(self, workers=None):
+        """Returns a list of all facebook names in chats, e.g. 10232342934@facebook.com, but with a working number
+        Parameters:
+            workers (optional): (int) The number of processes to scan conversations with, defaulting to self.workers
+        """
         facebook_person = re.compile("\d+@facebook.com")
+        index = self._aggregates()
+        if index is not None:
+            return sorted(person for person in index.people() if facebook_person.fullmatch(person))
+
         res = set()
-        for i in range(1, len(self) + 1):
-            convo = self.get_convo(i)
-            for person in convo.get_people():
+        for people in self._map_conversations(_people, workers=workers):
+            for person in people:
                 if facebook_person.fullmatch(person):
                     res.add(person)
         return sorted(list(res))
@@ -1189,6 +1277,18 @@ class MessageReader:
 
             clear_screen()
 
+    def _aggregates(self):
+        """Returns the AggregateIndex saved by setup.py or save_convo_edits(), or None if there isn't one that is up to
+        date with self.data, in which case analysis has to read every conversation
+        """
+        if self._edited_names:
+            return None
+        if self._aggregate_index is None:
+            self._aggregate_index = AggregateIndex.load()
+        if self._aggregate_index is None or not self._aggregate_index.matches(self.data):
+            return None
+        return self._aggregate_index
+
     def _get_first_chat_date(self) -> CustomDate:
         start_dates = []
         for i in range(len(self)):
@@ -1221,8 +1321,94 @@ class MessageReader:
         return 'MessageReader()'
 
 
+# ------------------------------------------   SCANNING CONVERSATIONS   ------------------------------------------- #
+
+_pool_data = None  # the data of the MessageReader running a parallel scan, inherited by its forked workers
+
+
+def _scan_conversation(data, name, person):
+    """Returns the tuple (senders, messages, times) for conversation name in data, as yielded by
+    MessageReader.scan_conversations(), or None if person (lower case) isn't None and isn't in the conversation"""
+    senders, messages, (times, _, _) = BaseConvoReader.columns(data[name])
+    if person is not None and person not in BaseConvoReader.people_in(name.lower(), senders):
+        return None
+    return senders, messages, times
+
+
+def _apply_to_conversation(function, name, person, args):
+    """Runs function on conversation name in a worker of MessageReader._map_conversations(), returning None if
+    person isn't in the conversation"""
+    columns = _scan_conversation(_pool_data, name, person)
+    if columns is None:
+        return None
+    return function(name, *columns, *args)
+
+
+def _messages_between(name, senders, messages, times, low, high):
+    """Returns (name, the number of messages sent from minute low (None for the beginning) until before minute high)
+    """
+    first = 0 if low is None else bisect_left(times, low)
+    return name, max(0, bisect_left(times, high) - first)
+
+
+def _emojis_sent(name, senders, messages, times, person):
+    """Returns a Counter of the emojis sent by person, or by everyone if person is None"""
+    return emojis.count_emojis(msg for sender, msg in zip(senders, messages) if person is None or sender == person)
+
+
+def _messages_by_day(name, senders, messages, times, contact, forward_shift):
+    """Returns a Counter of days since CustomDate.EPOCH mapped to the number of messages contact (or everyone, if
+    contact is None) sent, for every day from the first to the last message, as by ConvoReader.raw_msgs_graph()"""
+    total = Counter()
+    first_day = times[0] // (24 * 60)
+    for day in range(first_day, times[-1] // (24 * 60) + 1):
+        total[day] += 0
+    for sender, time in zip(senders, times):
+        if contact is None or sender == contact:
+            day = time // (24 * 60)
+            if time % (24 * 60) < forward_shift:  # counted as the previous day, but not before the first
+                day = max(first_day, day - 1)
+            total[day] += 1
+    return total
+
+
+def _people(name, senders, messages, times):
+    return BaseConvoReader.people_in(name.lower(), senders)
+
+# ------------------------------------------   SCANNING CONVERSATIONS   ------------------------------------------- #
+
+
 def contents_equal(lst1, lst2):
     if len(lst1) != len(lst2):
         return False
     filter = lambda x: x.lower()
     return sorted(map(filter, lst1)) == sorted(map(filter, lst2))
+
+
+if __name__ == '__main__':
+    # benchmark scanning every conversation with different numbers of workers, run from the project folder (after
+    # setup.py) with `python3 -m functions.messagereader [workers ...]`. Results are checked against one worker
+    import sys
+    import time
+
+    worker_counts = [int(arg) for arg in sys.argv[1:]] or [1, 4, 8, 16]
+    reader = MessageReader()
+    reader._aggregates = lambda: None  # scan the conversations rather than reading totals from the aggregate index
+    print("{0:,} conversations, {1} cpus".format(len(reader), os.cpu_count()))
+
+    def run_queries(workers):
+        return [reader.raw_top_conversations(workers=workers), reader.raw_emojis(workers=workers),
+                reader.raw_messages_graph(forward_shift=60, workers=workers), reader.raw_facebook_names(workers=workers)]
+
+    start = time.time()
+    expected = run_queries(1)
+    serial_time = time.time() - start
+    print("1 worker:   {0:.2f} seconds".format(serial_time))
+    for num_workers in worker_counts:
+        if num_workers == 1:
+            continue
+        start = time.time()
+        results = run_queries(num_workers)
+        elapsed = time.time() - start
+        assert results == expected, "{0} workers gave different results".format(num_workers)
+        print("{0} workers: {1:.2f} seconds ({2:.1f}x)".format(num_workers, elapsed, serial_time / elapsed))
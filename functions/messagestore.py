@@ -0,0 +1,509 @@
+import os
+import sys
+import json
+import mmap
+import shutil
+import itertools
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+
+from functions.customdate import CustomDate
+
+
+class MessageStore:
+    """Columnar on-disk storage for all conversation data, used in place of a single data.json file.
+
+    The store is a directory with the following layout:
+        index.json          the footer, preferences, time zones and, for each conversation, its parts, length and
+                            the list of people who sent messages in it
+        messages.txt        the text of every message of every conversation, UTF-8 encoded and concatenated
+        conversations/<id>  the columns of one part of a conversation: byte offsets of each message into messages.txt,
+                            epoch-minute timestamps, time zone codes and sender ids (indexes into its people list)
+
+    Each conversation can be loaded without reading the columns or text of any other conversation. messages.txt is
+    memory mapped rather than read, so the text of a message is only decoded when it is accessed.
+
+    A conversation is written as a single part, and messages added to its end later (see AppendedConversation) are
+    written as another part, so the messages already saved are never written again. Each part is saved in index.json
+    as [id, number of messages, bytes of text]. Text that no conversation uses any more is left in messages.txt until
+    it makes up more than COMPACT_RATIO of the file, when save() writes the whole store again.
+
+    index.json is always written last and replaces the previous index in one step, so a crash while saving leaves the
+    store as it was before. A new store is written to a directory next to path and then moved into place (see
+    _replace_directory())
+    """
+    STORE_PATH = 'data/store/'
+    VERSION = 2
+    COMPACT_RATIO = 0.5
+
+    # array typecodes for the columns of a conversation, in the order they are written to its file
+    OFFSETS_TYPE = 'Q'  # one more offset than messages, so message i is messages.txt[offsets[i]:offsets[i + 1]]
+    TIMES_TYPE = 'q'
+    TIME_ZONES_TYPE = 'B'
+    SENDERS_TYPE = 'H'
+
+    def __init__(self, path=STORE_PATH):
+        """Opens the store saved at path"""
+        self._recover(path)
+        self.path = path
+        with open(self.path + 'index.json', mode='r', encoding='utf-8') as f:
+            index = json.load(f)
+        assert index['version'] == MessageStore.VERSION, \
+            "Unsupported store version {0}, run setup.py again".format(index['version'])
+
+        self.footer = index['footer']
+        self.preferences = index['preferences']
+        self.time_zones = index['time_zones']
+        self._byteorder = index['byteorder']
+        self._conversations = index['conversations']  # name -> {'parts': list, 'length': int, 'people': list}
+        self._text_view = None  # memoryview of the memory mapped messages.txt, mapped on first use
+
+    # --------------------------------------------------   LOADING   ------------------------------------------------- #
+
+    @classmethod
+    def exists(cls, path=STORE_PATH) -> bool:
+        """Returns whether a store has been saved at path"""
+        cls._recover(path)
+        return os.path.isfile(path + 'index.json')
+
+    def names(self) -> list:
+        """Returns the names of all conversations in the store"""
+        return list(self._conversations.keys())
+
+    def conversation(self, name):
+        """Returns a StoredConversation for the conversation name. Nothing is read from disk until it is used"""
+        return StoredConversation(self, self._conversations[name]['parts'], self._conversations[name]['people'])
+
+    def _read_columns(self, convo_id, length):
+        """Returns the columns (offsets, times, time_zones, senders) of the part of a conversation with id convo_id"""
+        columns = []
+        with open(self._conversation_path(convo_id), mode='rb') as f:
+            for typecode, size in self._column_layout(length):
+                column = array(typecode)
+                column.fromfile(f, size)
+                if self._byteorder != sys.byteorder:
+                    column.byteswap()
+                columns.append(column)
+        return tuple(columns)
+
+    def _text(self) -> memoryview:
+        """Returns a read only memoryview of messages.txt, mapping the file into memory the first time it is used"""
+        if self._text_view is None:
+            with open(self.path + 'messages.txt', mode='rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:  # empty files can't be memory mapped
+                    self._text_view = memoryview(b'')
+                else:
+                    self._text_view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self._text_view
+
+    # --------------------------------------------------   LOADING   ------------------------------------------------- #
+
+    # --------------------------------------------------   WRITING   ------------------------------------------------- #
+
+    @classmethod
+    def write(cls, msgs, footer, preferences, path=STORE_PATH):
+        """Writes a new store at path, replacing any store already there, and returns it opened. The store is written
+        to a directory next to path that then replaces it, so a store at path is never left partly written
+        Parameters:
+            msgs: a dictionary mapping conversation names to lists of (person, message, date-time string) messages
+            footer: the footer of the facebook archive
+            preferences: the preferences dictionary of a PreferencesSearcher for msgs
+            path (optional): the directory to write the store to
+        """
+        cls._recover(path)
+        new_path = path.rstrip('/') + '.new/'
+        shutil.rmtree(new_path, ignore_errors=True)
+        os.makedirs(new_path + 'conversations')
+
+        time_zones = []
+        conversations = dict()
+        with open(new_path + 'messages.txt', mode='wb') as text:
+            for convo_id, (name, convo) in enumerate(msgs.items()):
+                conversations[name] = cls._write_conversation(new_path, convo_id, convo, text, time_zones)
+            cls._sync(text)
+        cls._sync_directory(new_path + 'conversations')
+
+        cls._write_index(new_path, footer, preferences, time_zones, conversations)
+        cls._replace_directory(new_path, path)
+        return cls(path)
+
+    def save(self, msgs, footer, preferences):
+        """Saves msgs to this store. Conversations in msgs that are StoredConversations of this store keep their
+        columns on disk (only their people lists are updated), and only the added messages of AppendedConversations of
+        this store are written, so only new messages and new or replaced conversations are written. If more than
+        COMPACT_RATIO of messages.txt is then text no conversation uses, the whole store is written again
+        Parameters:
+            msgs: a dictionary mapping conversation names to StoredConversations, AppendedConversations or lists of
+                  messages
+            footer: the footer of the facebook archive
+            preferences: the preferences dictionary of a PreferencesSearcher for msgs
+        """
+        conversations = dict()
+        new_conversations = []
+        for name, convo in msgs.items():
+            if isinstance(convo, StoredConversation) and convo.store is self:
+                conversations[name] = dict(parts=convo.parts, length=len(convo), people=convo.people)
+            elif isinstance(convo, AppendedConversation) and convo.stored.store is self:
+                new_conversations.append((name, convo.added, convo.stored))
+            else:
+                new_conversations.append((name, convo, None))
+
+        # new text is appended and new columns get new ids, so nothing the current index.json uses is changed until
+        # the new index replaces it. If saving stops before then, the appended text is never read
+        next_id = max([part[0] for entry in self._conversations.values() for part in entry['parts']] + [-1]) + 1
+        with open(self.path + 'messages.txt', mode='ab') as text:
+            for convo_id, (name, convo, stored) in enumerate(new_conversations, start=next_id):
+                conversations[name] = self._write_conversation(self.path, convo_id, convo, text, self.time_zones,
+                                                               byteorder=self._byteorder, stored=stored)
+            self._sync(text)
+        self._sync_directory(self.path + 'conversations')
+
+        self._write_index(self.path, footer, preferences, self.time_zones, conversations, byteorder=self._byteorder)
+
+        # remove the columns of conversations that are no longer part of the store
+        kept_ids = {part[0] for entry in conversations.values() for part in entry['parts']}
+        for entry in self._conversations.values():
+            for part in entry['parts']:
+                if part[0] not in kept_ids and os.path.isfile(self._conversation_path(part[0])):
+                    os.remove(self._conversation_path(part[0]))
+
+        # remap messages.txt on next use to include the appended text. Conversations that are already loaded keep
+        # the previous mapping, which stays valid even once messages.txt is compacted, since that replaces the file
+        self._text_view = None
+        self.footer = footer
+        self.preferences = preferences
+        self._conversations = conversations
+
+        used = sum(part[2] for entry in conversations.values() for part in entry['parts'])
+        unused = os.path.getsize(self.path + 'messages.txt') - used
+        if unused > MessageStore.COMPACT_RATIO * (used + unused):
+            self._compact(msgs)
+
+    def _compact(self, msgs):
+        """Writes the whole store again, leaving out text no conversation uses. The StoredConversations of this store
+        in msgs (the conversations saved) are pointed at their new columns
+        """
+        compacted = self.write(msgs, self.footer, self.preferences, path=self.path)
+        for name, convo in msgs.items():
+            if isinstance(convo, StoredConversation) and convo.store is self:
+                convo.parts, convo.people = compacted._conversations[name]['parts'], \
+                    compacted._conversations[name]['people']
+                convo._columns = convo._messages = None
+        self.time_zones = compacted.time_zones
+        self._byteorder = compacted._byteorder
+        self._conversations = compacted._conversations
+        self._text_view = None
+
+    @classmethod
+    def _write_conversation(cls, path, convo_id, convo, text, time_zones, byteorder=sys.byteorder,
+                            stored=None) -> dict:
+        """Appends the messages of convo to the open messages.txt file text and writes their columns as the part
+        convo_id, returning the entry for the conversation in index.json. If stored is a StoredConversation, convo is
+        the messages added to the end of it
+        """
+        offsets, times = array(cls.OFFSETS_TYPE, [text.tell()]), array(cls.TIMES_TYPE)
+        zone_codes, senders = array(cls.TIME_ZONES_TYPE), array(cls.SENDERS_TYPE)
+        people = [] if stored is None else list(stored.people)
+        sender_ids = {person: i for i, person in reversed(list(enumerate(people)))}  # the first of any duplicates
+
+        for person, msg, date_str in convo:
+            if person not in sender_ids:
+                sender_ids[person] = len(people)
+                people.append(person)
+            senders.append(sender_ids[person])
+
+            date = CustomDate(date_str)
+            assert str(CustomDate.from_epoch_minutes(date.epoch_minutes(), date.time_zone)) == date_str, \
+                "\"{0}\" is not a date that can be stored".format(date_str)
+            if date.time_zone not in time_zones:
+                time_zones.append(date.time_zone)
+            times.append(date.epoch_minutes())
+            zone_codes.append(time_zones.index(date.time_zone))
+
+            text.write(msg.encode('utf-8'))
+            offsets.append(text.tell())
+
+        parts = [] if stored is None else [list(part) for part in stored.parts]
+        parts.append([convo_id, len(times), offsets[-1] - offsets[0]])
+
+        with open(path + 'conversations/' + str(convo_id), mode='wb') as f:
+            for column in (offsets, times, zone_codes, senders):
+                if byteorder != sys.byteorder:
+                    column.byteswap()
+                column.tofile(f)
+            cls._sync(f)
+
+        return dict(parts=parts, length=sum(part[1] for part in parts), people=people)
+
+    @classmethod
+    def _write_index(cls, path, footer, preferences, time_zones, conversations, byteorder=sys.byteorder):
+        index = {
+            'version': cls.VERSION,
+            'byteorder': byteorder,
+            'footer': footer,
+            'preferences': preferences,
+            'time_zones': time_zones,
+            'conversations': conversations
+        }
+        # written next to index.json and then moved over it, so a store is never left with a partly written index
+        with open(path + 'index.json.tmp', mode='w', encoding='utf-8') as f:
+            json.dump(index, f)
+            cls._sync(f)
+        os.replace(path + 'index.json.tmp', path + 'index.json')
+        cls._sync_directory(path)
+
+    @classmethod
+    def _replace_directory(cls, new_path, path):
+        """Moves the store written at new_path to path. Any store at path is first moved aside to path.old, and only
+        deleted once the new store is in place. See _recover() for finishing a replacement that was interrupted
+        """
+        old_path = path.rstrip('/') + '.old/'
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.isdir(path):
+            os.rename(path.rstrip('/'), old_path.rstrip('/'))
+        os.rename(new_path.rstrip('/'), path.rstrip('/'))
+        cls._sync_directory(os.path.dirname(path.rstrip('/')) or '.')
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @staticmethod
+    def _recover(path):
+        """Finishes replacing the store at path if a previous write() was interrupted while moving the new store into
+        place: the new store is used if it was completely written, otherwise the store it was replacing is restored
+        """
+        new_path, old_path = path.rstrip('/') + '.new/', path.rstrip('/') + '.old/'
+        if not os.path.isfile(path + 'index.json'):
+            for saved_path in (new_path, old_path):  # index.json is the last file written to either
+                if os.path.isfile(saved_path + 'index.json'):
+                    shutil.rmtree(path, ignore_errors=True)
+                    os.rename(saved_path.rstrip('/'), path.rstrip('/'))
+                    break
+        if os.path.isdir(old_path) and os.path.isfile(path + 'index.json'):
+            shutil.rmtree(old_path)
+
+    @staticmethod
+    def _sync(file):
+        """Makes sure everything written to the open file has reached the disk"""
+        file.flush()
+        os.fsync(file.fileno())
+
+    @staticmethod
+    def _sync_directory(path):
+        """Makes sure files created, renamed or replaced in the directory path have reached the disk. Directories
+        can't be opened to be synced on every platform (e.g. Windows), where this does nothing
+        """
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # --------------------------------------------------   WRITING   ------------------------------------------------- #
+
+    @classmethod
+    def from_json(cls, json_path='data/data.json', path=STORE_PATH):
+        """Migrates a data.json file written by a previous version of setup.py to a store at path, returning the
+        opened store. The json file is left untouched
+        """
+        with open(json_path, mode='r', encoding='utf-8') as f:
+            all_data = json.load(f)
+        return cls.write(all_data['conversation_data'], all_data['footer'], all_data['preferences'], path=path)
+
+    def _conversation_path(self, convo_id):
+        return self.path + 'conversations/' + str(convo_id)
+
+    def _column_layout(self, length):
+        """Returns a list of (typecode, number of elements) for the columns of a part with length messages"""
+        return [(MessageStore.OFFSETS_TYPE, length + 1), (MessageStore.TIMES_TYPE, length),
+                (MessageStore.TIME_ZONES_TYPE, length), (MessageStore.SENDERS_TYPE, length)]
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def __repr__(self):
+        return "MessageStore({0})".format(repr(self.path))
+
+
+class StoredConversation(Sequence):
+    """A conversation saved in a MessageStore. Behaves like the list of (person, message, date-time string) tuples
+    saved in data.json, but its columns are only read from disk the first time they are needed, and the text of a
+    message is decoded from the store's memory mapped messages.txt each time it is accessed
+    """
+
+    def __init__(self, store, parts, people):
+        self.store = store
+        self.parts = [list(part) for part in parts]  # [id, number of messages, bytes of text] of each part
+        self.people = list(people)
+        self._len = sum(part[1] for part in self.parts)
+        self._columns = None
+        self._messages = None
+
+    def replace_person(self, old_name, new_name):
+        """Replaces every message sent by old_name (ignoring case) with new_name as the sender"""
+        for i, person in enumerate(self.people):
+            if person.lower() == old_name.lower():
+                self.people[i] = new_name
+
+    @property
+    def messages(self):
+        """A MessageTexts sequence of the text of each message, decoded on access"""
+        self._load()
+        return self._messages
+
+    def senders(self) -> list:
+        """Returns a list with the name of the person who sent each message"""
+        people = self.people
+        return [people[sender] for sender in self._load()[2]]
+
+    def timestamps(self) -> tuple:
+        """Returns the tuple (times, time_zones, zone_names), where times is an array of each message's minutes since
+        CustomDate.EPOCH, time_zones an array of codes for each message's time zone and zone_names the list of time
+        zone names those codes index
+        """
+        times, time_zones, _ = self._load()
+        return times, time_zones, self.store.time_zones
+
+    def date_strings(self) -> list:
+        """Returns a list with the date-time string of each message"""
+        times, time_zones, _ = self._load()
+        zones = self.store.time_zones
+        return [str(CustomDate.from_epoch_minutes(times[i], zones[time_zones[i]])) for i in range(self._len)]
+
+    def _load(self):
+        if self._columns is None:
+            columns = [self.store._read_columns(part[0], part[1]) for part in self.parts]
+            times, time_zones, senders = columns[0][1:]
+            for _, more_times, more_time_zones, more_senders in columns[1:]:
+                times.extend(more_times)
+                time_zones.extend(more_time_zones)
+                senders.extend(more_senders)
+            self._messages = MessageTexts(self.store._text(), *(offsets for offsets, _, _, _ in columns))
+            self._columns = (times, time_zones, senders)
+        return self._columns
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("conversation index out of range")
+
+        times, time_zones, senders = self._load()
+        date_str = str(CustomDate.from_epoch_minutes(times[index], self.store.time_zones[time_zones[index]]))
+        return self.people[senders[index]], self._messages[index], date_str
+
+    def __iter__(self):
+        return zip(self.senders(), self.messages, self.date_strings())
+
+    def __len__(self):
+        return self._len
+
+    def __repr__(self):
+        return "StoredConversation({0}, {1})".format(repr(self.store), [part[0] for part in self.parts])
+
+
+class AppendedConversation(Sequence):
+    """A StoredConversation with messages added to its end that haven't been saved yet, as setup.py --update finds
+    them. Behaves like the list of all of its messages, and MessageStore.save() only writes the added ones
+    """
+
+    def __init__(self, stored, added):
+        """Parameters:
+            stored: the StoredConversation
+            added: a list of (person, message, date-time string) messages sent after the end of stored
+        """
+        self.stored = stored
+        self.added = list(added)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("conversation index out of range")
+        return self.stored[index] if index < len(self.stored) else self.added[index - len(self.stored)]
+
+    def __iter__(self):
+        return itertools.chain(self.stored, self.added)
+
+    def __len__(self):
+        return len(self.stored) + len(self.added)
+
+    def __repr__(self):
+        return "AppendedConversation({0}, {1:,} added)".format(repr(self.stored), len(self.added))
+
+
+class MessageTexts(Sequence):
+    """The text of a conversation's messages, stored as UTF-8 in a buffer (normally a memory mapped file) and
+    addressed by an array of byte offsets. Messages are decoded straight from the buffer when accessed, and nothing
+    decoded is kept.
+
+    A conversation saved in several parts has an array of offsets for each part, since the text of one part doesn't
+    continue where the text of the part before it ends
+    """
+
+    def __init__(self, buffer, offsets, *more_offsets):
+        self._buffer = buffer
+        self._offsets = offsets
+        self._parts = [offsets] + list(more_offsets)
+        self._firsts = [0]  # the index of the first message of each part, then the number of messages
+        for part in self._parts:
+            self._firsts.append(self._firsts[-1] + len(part) - 1)
+
+    def _locate(self, index) -> tuple:
+        """Returns the tuple (offsets, i) of the offsets of the part with message index, and its index in the part"""
+        if len(self._parts) == 1:
+            return self._offsets, index
+        part = bisect_right(self._firsts, index, hi=len(self._parts)) - 1
+        return self._parts[part], index - self._firsts[part]
+
+    def byte_length(self, index) -> int:
+        """Returns the length in bytes of message index, without decoding it"""
+        offsets, index = self._locate(index)
+        return offsets[index + 1] - offsets[index]
+
+    def encoded(self, stop=None):
+        """Returns the UTF-8 text of the messages before index stop (all of them by default) one after another,
+        without decoding it. The text is a memoryview of the buffer, or bytes if the messages are in several parts
+        """
+        stop = len(self) if stop is None else stop
+        if len(self._parts) == 1:
+            return self._buffer[self._offsets[0]:self._offsets[stop]]
+        pieces = []
+        for offsets, first in zip(self._parts, self._firsts):
+            if first >= stop:
+                break
+            pieces.append(self._buffer[offsets[0]:offsets[min(stop - first, len(offsets) - 1)]])
+        return b''.join(pieces)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        offsets, index = self._locate(index)
+        return str(self._buffer[offsets[index]:offsets[index + 1]], 'utf-8')
+
+    def __iter__(self):
+        buffer = self._buffer
+        for offsets in self._parts:
+            for i in range(len(offsets) - 1):
+                yield str(buffer[offsets[i]:offsets[i + 1]], 'utf-8')
+
+    def __len__(self):
+        return self._firsts[-1]
+
+
+if __name__ == '__main__':
+    # one time migration of data/data.json, run with `python3 -m functions.messagestore`
+    if MessageStore.exists():
+        print("A store already exists at {0}".format(MessageStore.STORE_PATH))
+    else:
+        store = MessageStore.from_json()
+        print("Migrated {0:,} conversations to {1}".format(len(store), MessageStore.STORE_PATH))
@@ -3,11 +3,21 @@ import shutil
 import time
 import textwrap
 import json
+import codecs
+import io
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
 from bs4 import BeautifulSoup
 from colorama import init, Fore, Back, Style
 
 
 from functions.customdate import CustomDate
+from functions.messagestore import StoredConversation, AppendedConversation
+from functions.mergedecisions import MergeDecisions
+from functions.datajson import JsonConversation
+import functions.emojis as emojis
 
 
 init(autoreset=True)
@@ -83,7 +93,7 @@ def get_all_threads_unordered(all_divs):
 
 def get_messages_readable(thread, previous=None):
     """Returns a list of tuples of length 3. First element is person speaking,
-    second message, third time
+    second message (with emojis.emojify applied), third time
     """
     if previous is None:
         previous = []
@@ -106,7 +116,7 @@ def get_messages_readable(thread, previous=None):
         time = [div for div in div_ids[i]('span', class_='meta')][0].contents[0]
 
         try:
-            msg = messages[i].get_text()
+            msg = emojis.emojify(messages[i].get_text())
         except IndexError:
             msg = ''
         previous.append( (person, msg, time) )
@@ -114,8 +124,230 @@ def get_messages_readable(thread, previous=None):
     return previous
 
 
-def get_all_msgs_dict(msg_html_path, unordered_threads, footer, times):
-    """Returns the dictionary used by MessageReader"""
+class ThreadStream:
+    """Reads messages.htm incrementally, yielding one thread at a time instead of building a tree for the whole
+    archive. Memory use is bounded by the largest thread rather than by the size of the file.
+
+    Iterating yields tuples (convo_name, messages), with messages in the same format returned by
+    get_messages_readable (so already emojified). Once iteration has finished the archive's footer is available as
+    self.footer
+
+    If jobs is greater than 1 the archive is split into byte ranges that each start at a thread, and the ranges are
+    parsed in a pool of jobs processes. Threads are still yielded in the order they appear in the archive, but each
+    range is held in memory until it has been yielded. Parallel parsing needs the 'fork' start method, so on
+    platforms without it (Windows) the archive is parsed serially
+    """
+    CHUNK_SIZE = 2 ** 16  # number of characters fed to the parser at a time
+    RANGES_PER_JOB = 4  # byte ranges per process, so that uneven ranges still keep every process busy
+
+    def __init__(self, msg_html_path, jobs=1):
+        assert isinstance(jobs, int) and jobs >= 1, "jobs must be a positive integer"
+        self.msg_html_path = msg_html_path
+        self.jobs = jobs
+        self.footer = None
+
+    def __iter__(self):
+        try:
+            text = open(self.msg_html_path, mode='r', encoding='UTF8')
+        except OSError as err:
+            print('OS error: {0}'.format(err))
+            exit()
+
+        if self.jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            text.close()
+            yield from self._iter_parallel()
+            return
+
+        parser = _ThreadParser()
+        with text:
+            for chunk in iter(lambda: text.read(ThreadStream.CHUNK_SIZE), ''):
+                parser.feed(chunk)
+                while parser.threads:
+                    yield parser.threads.popleft()
+        parser.close()
+        while parser.threads:
+            yield parser.threads.popleft()
+
+        self.footer = parser.footer
+
+    def _iter_parallel(self):
+        ranges = thread_byte_ranges(self.msg_html_path, self.jobs * ThreadStream.RANGES_PER_JOB)
+        starts, ends = zip(*ranges)
+
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=self.jobs, mp_context=context) as executor:
+            for threads, footer in executor.map(_parse_byte_range, [self.msg_html_path] * len(ranges), starts, ends):
+                yield from threads
+                if footer is not None:
+                    self.footer = footer
+
+
+def thread_byte_ranges(msg_html_path, num_ranges):
+    """Splits messages.htm into at most num_ranges consecutive (start, end) byte ranges covering the whole file, with
+    every range after the first starting at a thread div. Since no thread is split between two ranges, each range can
+    be parsed independently
+    """
+    marker = b'<div class="thread">'
+    size = os.path.getsize(msg_html_path)
+
+    starts = [0]
+    with open(msg_html_path, mode='rb') as f:
+        for i in range(1, num_ranges):
+            offset = max(size * i // num_ranges, starts[-1] + 1)
+            f.seek(offset)
+
+            # read forward until the next thread starts, keeping enough of the previous block to catch a marker
+            # that is split between two reads
+            previous = b''
+            while True:
+                block = f.read(ThreadStream.CHUNK_SIZE)
+                if not block:
+                    break
+                found = (previous + block).find(marker)
+                if found != -1:
+                    starts.append(offset - len(previous) + found)
+                    break
+                offset += len(block)
+                previous = block[-(len(marker) - 1):]
+            if len(starts) == i:  # no thread starts after this point, so there are no more ranges
+                break
+
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _parse_byte_range(msg_html_path, start, end):
+    """Parses the threads in bytes [start, end) of messages.htm, returning a tuple (threads, footer) where threads is a
+    list of (convo_name, messages) tuples and footer is None unless the footer is in the range. Used by ThreadStream
+    """
+    # decodes the same way as opening the file in text mode, including the translation of newlines
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    parser = _ThreadParser()
+    with open(msg_html_path, mode='rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(ThreadStream.CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+
+    return list(parser.threads), parser.footer
+
+
+class _ThreadParser(HTMLParser):
+    """Event driven parser for messages.htm used by ThreadStream. Each completed thread is appended to self.threads
+    as a tuple (convo_name, messages), and the text of the footer div is saved to self.footer
+    """
+    VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr'}
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.threads = deque()
+        self.footer = None
+
+        self._depth = 0  # number of currently open tags
+        self._thread_depth = None  # depth of the thread div currently being read, or None if outside of a thread
+        self._name_parts = None  # pieces of the current thread's name, or None once the name has been read
+        self._convo_name = None
+        self._people, self._times, self._messages = [], [], []
+
+        self._text = None  # list of text pieces currently being captured
+        self._text_depth = None  # capturing stops once the tag opened at this depth is closed
+        self._text_target = None  # where the captured text is saved: 'user', 'meta', 'p' or 'footer'
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _ThreadParser.VOID_TAGS:
+            return
+        self._depth += 1
+        classes = (dict(attrs).get('class') or '').split()
+
+        if self._thread_depth is not None:
+            if self._name_parts is not None:
+                self._finish_name()
+            if self._depth == self._thread_depth + 1:
+                if tag == 'div' and 'message' in classes:
+                    self._people.append(None)
+                    self._times.append(None)
+                elif tag == 'p':
+                    self._start_text('p')
+            elif tag == 'span' and self._text is None and self._people:
+                if 'user' in classes and self._people[-1] is None:
+                    self._start_text('user')
+                elif 'meta' in classes and self._times[-1] is None:
+                    self._start_text('meta')
+        elif tag == 'div' and 'thread' in classes:
+            self._thread_depth = self._depth
+            self._name_parts = []
+            self._people, self._times, self._messages = [], [], []
+        elif tag == 'div' and 'footer' in classes and self._text is None:
+            self._start_text('footer')
+
+    def handle_endtag(self, tag):
+        if tag in _ThreadParser.VOID_TAGS or self._depth == 0:
+            return
+        if self._text is not None and self._depth == self._text_depth:
+            self._finish_text()
+        if self._thread_depth is not None and self._depth == self._thread_depth:
+            self._finish_thread()
+        self._depth -= 1
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+        elif self._name_parts is not None:
+            self._name_parts.append(data)
+
+    def _start_text(self, target):
+        self._text = []
+        self._text_depth = self._depth
+        self._text_target = target
+
+    def _finish_text(self):
+        text = ''.join(self._text)
+        if self._text_target == 'user':
+            self._people[-1] = text
+        elif self._text_target == 'meta':
+            self._times[-1] = text
+        elif self._text_target == 'p':
+            # emojified here rather than in a second pass over every message once the archive has been read
+            self._messages.append(emojis.emojify(text))
+        else:
+            self.footer = text
+        self._text = self._text_depth = self._text_target = None
+
+    def _finish_name(self):
+        self._convo_name = clean_convo_name(''.join(self._name_parts))
+        self._name_parts = None
+
+    def _finish_thread(self):
+        if self._name_parts is not None:
+            self._finish_name()
+        assert len(self._people) == len(self._messages), 'div_ids and messages\
+                                             have different lengths'
+        messages = list(zip(self._people, self._messages, self._times))
+        messages.reverse()
+        self.threads.append((self._convo_name, messages))
+        self._thread_depth = None
+        self._convo_name = None
+
+
+def get_all_msgs_dict(msg_html_path, threads, footer, times, msgs=None, decisions=None):
+    """Returns the dictionary used by MessageReader
+    Parameters:
+        msg_html_path: the path to messages.htm, used if threads is None
+        threads: an iterable of (convo_name, messages) tuples, such as a ThreadStream. If None the archive at
+                 msg_html_path is streamed
+        footer: the archive's footer as a string, or None to use threads.footer once all threads have been read
+        times: a list that timing checkpoints of setup are appended to
+        msgs (optional): a dictionary of conversations that have already been set up, mapping the names setup gave
+                         them to lists of messages. Threads with the same name are treated as duplicates of them
+        decisions (optional): a MergeDecisions that decides whether threads with the same name are one conversation
+                              before the user is asked, and saves the decisions made. Nothing is saved if None
+    """
     conversation_color = Fore.LIGHTYELLOW_EX + Back.LIGHTBLACK_EX
     previous_color = Fore.LIGHTCYAN_EX + Back.BLACK
     current_color = Fore.LIGHTGREEN_EX + Back.BLACK
@@ -140,32 +372,37 @@ def get_all_msgs_dict(msg_html_path, unordered_threads, footer, times):
 
             if prev_time.distance_from(next_time) <= 0:
                 # if our current conversation was during or after the last message in the new_name convo
-                print(one_line())
-                print()
-                print(one_line())
-
-                print("#{0} of {1} (at maximum) duplicate conversations. Some might be done for you behind the scenes."
-                      .format(duplicate_index, num_duplicates))
-                print(conversation_color + key)
-                print(one_line() + "\n")
-
-                print(previous_color + '# previous conversation end - length = {0:,}'.format(len(msgs[new_name]))
-                      + Style.RESET_ALL)
-                print_thread(msgs[new_name], end=True, padding=10)
-
-                print(current_color + "\n# next conversation start - length = {0:,} (maximum possible length is 10,000)"
-                      .format(len(cur_thread)) + Style.RESET_ALL)
-                print_thread(cur_thread, start=True, padding=10)
-
-                print('\n' + one_line())
-                # Prints the last 5 messages of the previous message group and the first 5 message of
-                # the current message group, both in RED with a BLACK background
-
-                print(are_same_color + "\nAre these two chunks from the same conversation? You might have "
-                                       "to look this up on facebook.com/messages [Y/n]" + Style.RESET_ALL)
-
-                are_same = user_says_yes()
-                # User input for whether the two message groups are in the same conversation
+                are_same = decisions.replay(new_name, msgs[new_name], cur_thread)
+                if are_same is None and decisions.auto_merge:
+                    are_same = decisions.auto(new_name, msgs[new_name], cur_thread)
+                if are_same is None:
+                    print(one_line())
+                    print()
+                    print(one_line())
+
+                    print("#{0} of {1} (at maximum) duplicate conversations. Some might be done for you behind the "
+                          "scenes.".format(duplicate_index, num_duplicates))
+                    print(conversation_color + key)
+                    print(one_line() + "\n")
+
+                    print(previous_color + '# previous conversation end - length = {0:,}'.format(len(msgs[new_name]))
+                          + Style.RESET_ALL)
+                    print_thread(msgs[new_name], end=True, padding=10)
+
+                    print(current_color + "\n# next conversation start - length = {0:,} (maximum possible length is "
+                                          "10,000)".format(len(cur_thread)) + Style.RESET_ALL)
+                    print_thread(cur_thread, start=True, padding=10)
+
+                    print('\n' + one_line())
+                    # Prints the last 5 messages of the previous message group and the first 5 message of
+                    # the current message group, both in RED with a BLACK background
+
+                    print(are_same_color + "\nAre these two chunks from the same conversation? You might have "
+                                           "to look this up on facebook.com/messages [Y/n]" + Style.RESET_ALL)
+
+                    are_same = user_says_yes()
+                    # User input for whether the two message groups are in the same conversation
+                    decisions.record(new_name, msgs[new_name], cur_thread, are_same, 'user')
 
                 if not are_same:
                     duplicate_num += 1  # if they aren't the same, increment duplicate_num and try again
@@ -209,16 +446,16 @@ def get_all_msgs_dict(msg_html_path, unordered_threads, footer, times):
         return
 
     # Getting values if default arguments were left as default
-    if unordered_threads is None or footer is None:
-        all_thread_containers = get_all_thread_containers(msg_html_path)
-        unordered_threads, footer = get_all_threads_unordered(all_thread_containers)
+    if threads is None:
+        threads = ThreadStream(msg_html_path)
+    if decisions is None:
+        decisions = MergeDecisions()
 
-    msgs = dict()  # result we return
+    if msgs is None:
+        msgs = dict()  # result we return
     duplicate_bucket = dict()  # temporarily holds duplicate conversations
     num_duplicates = 0
-    for thread in unordered_threads:
-        convo_name = clean_convo_name(thread.contents[0])
-        cur_thread = get_messages_readable(thread)
+    for convo_name, cur_thread in threads:
         if convo_name not in msgs:
             # A conversation with the name of current message group does not exist, so it is added with no issues :D
             msgs[convo_name] = cur_thread
@@ -230,6 +467,9 @@ def get_all_msgs_dict(msg_html_path, unordered_threads, footer, times):
             else:
                 duplicate_bucket[convo_name] = [cur_thread]
 
+    if footer is None:
+        footer = threads.footer
+
     # The following is used in setup to time how long it takes various processes
     # This timing counts the time that user input starts, as there can be a lag before
     times.append(time.time())  # Background setup done
@@ -239,7 +479,8 @@ def get_all_msgs_dict(msg_html_path, unordered_threads, footer, times):
         "easier read the messages printed)\n"
     )
     input_text = textwrap.fill(input_text, width=min(shutil.get_terminal_size().columns, 150))
-    input(input_text)
+    if len(duplicate_bucket) > 0 and not decisions.auto_merge:  # there is nothing to ask about otherwise
+        input(input_text)
     # this time is user input prompt time
     times.append(time.time())  # User selection is starting
 
@@ -255,9 +496,23 @@ def get_all_msgs_dict(msg_html_path, unordered_threads, footer, times):
             # message group's last message and this message group's first message. This time helps
             # determine whether both message groups belong to the same conversation
 
-            if -3 <= prev_time.distance_from(next_time) <= 0 and len(msgs[key]) > 10000 and len(cur_thread) == 10000:
-                msgs[key].extend(cur_thread)
-                duplicate_index += 1
+            are_same = None
+            if prev_time.distance_from(next_time) <= 0:
+                are_same = decisions.replay(key, msgs[key], cur_thread)
+            if are_same is None and -3 <= prev_time.distance_from(next_time) <= 0 and len(msgs[key]) > 10000 \
+                    and len(cur_thread) == 10000:
+                are_same = True
+                decisions.record(key, msgs[key], cur_thread, are_same, 'rule')
+            elif are_same is None and prev_time.distance_from(next_time) <= 0 and decisions.auto_merge:
+                are_same = decisions.auto(key, msgs[key], cur_thread)
+
+            if are_same is not None:
+                # decided without asking the user
+                if are_same:
+                    msgs[key].extend(cur_thread)
+                    duplicate_index += 1
+                else:
+                    add_to_duplicate()
             elif prev_time.distance_from(next_time) <= 0:
 
                 clear_screen()
@@ -284,6 +539,7 @@ def get_all_msgs_dict(msg_html_path, unordered_threads, footer, times):
 
                 are_same = user_says_yes()
                 # user input to decide if the above two message groups are the same conversation
+                decisions.record(key, msgs[key], cur_thread, are_same, 'user')
 
                 if are_same:
                     msgs[key].extend(cur_thread)
@@ -308,17 +564,204 @@ def get_all_msgs_dict(msg_html_path, unordered_threads, footer, times):
     return msgs, str(footer), quick_preferences.preferences
 
 
+def update_msgs_dict(msg_html_path, msgs, threads, footer, times, decisions=None):
+    """Adds the messages in the archive that aren't in msgs yet to the conversations in msgs, for setup.py --update.
+    Returns a tuple (msgs, footer, preferences, changed) like get_all_msgs_dict, where changed is the set of names of
+    conversations that were added to or are new. StoredConversations that were added to are returned as
+    AppendedConversations
+
+    Each conversation in msgs is recognized in the archive by its messages rather than its name, so conversations
+    renamed with MessageReader.edit_convo_participants are still found. A thread is part of a conversation if its
+    first message is the conversation's first message, or the message following the previous thread of that
+    conversation, and its last message (or the conversation's last message, if the thread goes past it) matches too.
+    Only the messages of a thread after the end of its conversation are added, with senders renamed the way they
+    were in the conversation. Threads that aren't part of any conversation in msgs are set up like get_all_msgs_dict
+    would, so only they can lead to questions about duplicate conversations. Conversations in msgs that aren't in
+    the archive are kept as they are
+    Parameters:
+        msg_html_path: the path to messages.htm
+        msgs: a dictionary mapping conversation names to the lists of messages or StoredConversations already set up
+        threads: an iterable of (convo_name, messages) tuples, such as a ThreadStream
+        footer: the archive's footer as a string, or None to use threads.footer once all threads have been read
+        times: a list that timing checkpoints of setup are appended to
+        decisions (optional): a MergeDecisions used for the threads that aren't part of a conversation, as in
+                              get_all_msgs_dict
+    """
+    def same_message(convo, index, message):
+        """Whether message (from the archive) is message index of convo, ignoring who sent it"""
+        return convo[index][2] == message[2] and convo[index][1] == message[1]
+
+    def senders(name):
+        if name not in convo_senders:
+            convo = msgs[name]
+            convo_senders[name] = convo.senders() if isinstance(convo, StoredConversation) \
+                else [person for person, _, _ in convo]
+        return convo_senders[name]
+
+    first_messages = dict()  # (message, date) of the first message -> names of conversations starting with it
+    for name, convo in msgs.items():
+        if len(convo) > 0:
+            first_messages.setdefault((convo[0][1], convo[0][2]), []).append(name)
+
+    found = dict()  # archive name -> list of [name, messages read] for conversations in msgs found under it
+    matched = set()
+    added = dict()  # name -> messages from the archive after the end of the conversation
+    renames = dict()  # name -> dictionary mapping senders in the archive to senders in the conversation
+    convo_senders = dict()
+    new_threads = []
+    for archive_name, thread in threads:
+        match = None
+        if len(thread) > 0:
+            for entry in found.get(archive_name, []):
+                name, position = entry
+                if position < len(msgs[name]) and same_message(msgs[name], position, thread[0]):
+                    match = entry
+                    break
+            else:
+                first = (thread[0][1], thread[0][2])
+                for name in first_messages.get(first, []):
+                    if name not in matched:
+                        match = [name, 0]
+                        break
+
+        if match is not None:
+            name, position = match
+            overlap = min(len(thread), len(msgs[name]) - position)
+            if not same_message(msgs[name], position + overlap - 1, thread[overlap - 1]):
+                match = None
+        if match is None:
+            new_threads.append((archive_name, thread))
+            continue
+
+        if name not in matched:
+            matched.add(name)
+            found.setdefault(archive_name, []).append(match)
+        rename = renames.setdefault(name, dict())
+        for person, convo_person in zip((person for person, _, _ in thread[:overlap]),
+                                        senders(name)[position:position + overlap]):
+            rename[person] = convo_person
+        if overlap < len(thread):
+            added.setdefault(name, []).extend(thread[overlap:])
+        match[1] += len(thread)
+
+    if footer is None:
+        footer = threads.footer
+
+    # threads that aren't part of a conversation are set up as they would be from scratch, with the conversations
+    # found under the same name in the archive given the names setup would have given them
+    setup_names = dict()  # name given for setup -> name in msgs
+    for archive_name in set(archive_name for archive_name, _ in new_threads):
+        for i, (name, _) in enumerate(found.get(archive_name, [])):
+            setup_names[archive_name if i == 0 else archive_name + ', DUPLICATE #{0}'.format(i)] = name
+    previous = {setup_name: list(msgs[name]) + added.get(name, []) for setup_name, name in setup_names.items()}
+    new_msgs, _, _ = get_all_msgs_dict(msg_html_path, new_threads, footer, times, msgs=previous,
+                                       decisions=decisions)
+
+    res = dict()
+    changed = set()
+    for setup_name, convo in new_msgs.items():
+        if setup_name in setup_names:
+            added[setup_names[setup_name]] = convo[len(msgs[setup_names[setup_name]]):]
+    for name, convo in msgs.items():
+        if len(added.get(name, [])) > 0:
+            rename = renames.get(name, dict())
+            new_messages = [(rename.get(person, person), msg, date) for person, msg, date in added[name]]
+            # so that only the new messages are saved to the store
+            res[name] = AppendedConversation(convo, new_messages) if isinstance(convo, StoredConversation) \
+                else list(convo) + new_messages
+            changed.add(name)
+        else:
+            res[name] = convo
+    for setup_name, convo in new_msgs.items():
+        if setup_name not in setup_names:
+            name, duplicate_num = setup_name, 0
+            while name in res:  # a conversation in msgs that wasn't found in the archive has this name
+                duplicate_num += 1
+                name = setup_name + ', DUPLICATE #{0}'.format(duplicate_num)
+            res[name] = convo
+            changed.add(name)
+
+    return res, str(footer), PreferencesSearcher.from_msgs_dict(res).preferences, changed
+
+
+def move_conversation_data(old_preferences, new_preferences, path='data/conversation_data/'):
+    """Moves the folder of saved data (preferences.txt and caches) of each conversation from its rank in
+    old_preferences to its rank in new_preferences. Conversations are ranked by their number of messages, so adding
+    messages with setup.py --update can change which folder belongs to which conversation. Folders of conversations
+    that aren't in new_preferences, and folders at the ranks of new conversations, are removed
+    Parameters:
+        old_preferences: the preferences dictionary the folders were saved with
+        new_preferences: the preferences dictionary of a PreferencesSearcher for the updated conversations
+        path (optional): the folder holding the folder of each conversation
+    """
+    def ranks(preferences):
+        # 'length' maps both names to (rank, length) and ranks to (name, length)
+        return {name: entry[0] for name, entry in preferences['length'].items() if isinstance(entry[0], int)}
+
+    old_ranks, new_ranks = ranks(old_preferences), ranks(new_preferences)
+    moves = {old_ranks[name]: new_ranks.get(name) for name in old_ranks if new_ranks.get(name) != old_ranks[name]}
+
+    # every folder is moved aside first, since a conversation can move to the rank another one is moving from
+    for old_rank in moves:
+        if os.path.isdir(path + str(old_rank)):
+            os.rename(path + str(old_rank), path + str(old_rank) + '.moving')
+    for name, new_rank in new_ranks.items():
+        if name not in old_ranks:
+            shutil.rmtree(path + str(new_rank), ignore_errors=True)
+    for old_rank, new_rank in moves.items():
+        if not os.path.isdir(path + str(old_rank) + '.moving'):
+            continue
+        if new_rank is None:
+            shutil.rmtree(path + str(old_rank) + '.moving')
+        else:
+            shutil.rmtree(path + str(new_rank), ignore_errors=True)  # left by a conversation that's no longer saved
+            os.rename(path + str(old_rank) + '.moving', path + str(new_rank))
+
+
 def clean_convo_name(name, split_factor=', ') -> str:
     return split_factor.join(sorted(name.split(split_factor)))
 
 
-def data_as_json(msgs, footer, preferences):
-    all_data = {
-        'conversation_data': msgs,
-        'footer': footer,
-        'preferences': preferences
-    }
-    return json.dumps(all_data)
+def write_data_json(file, msgs, footer, preferences):
+    """Writes the same json as json.dumps of the data.json dictionary to the open text file file, one conversation at a
+    time, so that the json for all of the data is never held in memory at once
+    Parameters:
+        file: a file opened for writing text
+        msgs: a dictionary mapping conversation names to lists of messages, StoredConversations or JsonConversations
+        footer: the footer of the facebook archive
+        preferences: the preferences dictionary of a PreferencesSearcher for msgs
+    """
+    file.write('{"conversation_data": {')
+    for i, (name, convo) in enumerate(msgs.items()):
+        if i > 0:
+            file.write(', ')
+        file.write(json.dumps(name))
+        file.write(': ')
+        if isinstance(convo, JsonConversation):
+            file.write(convo.json())
+        else:
+            file.write(json.dumps(convo if isinstance(convo, list) else list(convo)))
+    file.write('}, "footer": ')
+    file.write(json.dumps(footer))
+    file.write(', "preferences": ')
+    file.write(json.dumps(preferences))
+    file.write('}')
+
+
+def save_data_json(path, msgs, footer, preferences):
+    """Saves msgs, footer and preferences to path in the format of data.json with write_data_json. The json is written
+    to a temporary file next to path that then replaces path, so path is never left partly written
+    """
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, mode='w', encoding='utf-8') as f:
+            write_data_json(f, msgs, footer, preferences)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
 
 
 class PreferencesSearcher:
@@ -0,0 +1,96 @@
+try:
+    from re import _parser as sre_parse  # python 3.11+
+except ImportError:
+    import sre_parse
+
+
+class TrigramIndex:
+    """An index of the three character sequences (trigrams) in a conversation's messages, mapping each trigram to the
+    sorted list of indexes of the messages containing it. A message can only contain a string (or fully match a regex
+    requiring that string) if it contains every trigram of the string, so intersecting their lists narrows down which
+    messages a search has to check.
+
+    Messages and queries are folded with lower() followed by casefold(), and the dotted and dotless i's made plain i's.
+    Folding this way maps every pair of characters that case insensitive searches and regexes treat as equal to the same
+    characters, and folds a piece of a string to the matching piece of the folded string, so one index can narrow down
+    case sensitive and case insensitive searches.
+    """
+
+    def __init__(self, messages):
+        """Builds the index of messages, a sequence of the text of each message in a conversation"""
+        self._trigrams = dict()  # trigram -> sorted list of message indexes
+        for i, msg in enumerate(messages):
+            text = self.fold(msg)
+            for trigram in set(text[j:j + 3] for j in range(len(text) - 2)):
+                if trigram not in self._trigrams:
+                    self._trigrams[trigram] = [i]
+                else:
+                    self._trigrams[trigram].append(i)
+
+    @staticmethod
+    def fold(text) -> str:
+        # regexes ignoring case also treat the dotted and dotless i's as an i, which lower() and casefold() don't
+        return text.lower().casefold().replace('ı', 'i').replace('\u0307', '')
+
+    def candidates(self, literals):
+        """Returns a sorted list of the indexes of messages that might contain every string in literals, or None if
+        the index can't narrow the search down (no string in literals has three characters once folded)
+        """
+        trigrams = set()
+        for literal in literals:
+            text = self.fold(literal)
+            trigrams.update(text[j:j + 3] for j in range(len(text) - 2))
+        if len(trigrams) == 0:
+            return None
+
+        postings = sorted((self._trigrams.get(trigram, []) for trigram in trigrams), key=len)
+        res = set(postings[0])
+        for indexes in postings[1:]:
+            if len(res) == 0:
+                break
+            res.intersection_update(indexes)
+        return sorted(res)
+
+    @staticmethod
+    def required_literals(pattern) -> list:
+        """Returns a list of strings that must all appear in any string fully matching the regex pattern
+        Raises:
+            re.error if pattern isn't a valid regex
+        """
+        return TrigramIndex._literals_in(sre_parse.parse(pattern))
+
+    @staticmethod
+    def _literals_in(items) -> list:
+        """Returns the strings required by a parsed regex (or part of one). Only literals outside of alternatives,
+        character sets, assertions and optional repeats are required
+        """
+        res, run = [], ''
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                run += chr(av)
+                continue
+            if len(run) > 0:
+                res.append(run)
+                run = ''
+            if op is sre_parse.SUBPATTERN:
+                res.extend(TrigramIndex._literals_in(av[-1]))
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+                res.extend(TrigramIndex._literals_in(av[2]))
+            elif op is getattr(sre_parse, 'POSSESSIVE_REPEAT', None) and av[0] >= 1:
+                res.extend(TrigramIndex._literals_in(av[2]))
+            elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+                res.extend(TrigramIndex._literals_in(av))
+        if len(run) > 0:
+            res.append(run)
+        return res
+
+    def num_postings(self) -> int:
+        """Returns the total length of all the lists of message indexes"""
+        return sum(len(indexes) for indexes in self._trigrams.values())
+
+    def __len__(self):
+        """Returns the number of distinct trigrams indexed"""
+        return len(self._trigrams)
+
+    def __repr__(self):
+        return "<TrigramIndex of {0:,} trigrams, {1:,} postings>".format(len(self), self.num_postings())
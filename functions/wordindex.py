@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import hashlib
+from array import array
+
+from functions.messagestore import MessageTexts
+
+
+class WordIndex:
+    """An inverted index of the words in a conversation's messages, mapping each word to the sorted list of indexes of
+    the messages it appears in. Used to narrow down the messages a search has to look at.
+
+    Words are the whitespace separated pieces of each message, folded to lower case, so the index can narrow down both
+    case sensitive and case insensitive searches. Searches still check every message the index returns, so the index
+    only ever saves work and never changes results.
+
+    The index is saved as json next to the conversation's other data by setup (see save()), along with a hash of the
+    messages it covers. When a conversation grows only the new messages are added to it.
+    """
+
+    VERSION = 2
+    FILE_NAME = 'word_index.json'
+
+    def __init__(self, convo_name, words=None, length=0, content_hash=None):
+        self.convo_name = convo_name
+        self._words = dict() if words is None else words  # word -> sorted list of message indexes
+        self._length = length  # the number of messages indexed
+        self._hash = content_hash  # content_hash() of the messages indexed, None until they're hashed
+        self._changed = False  # whether messages were added since the index was loaded
+        self.build_time = 0.0  # seconds spent loading and adding to this index
+
+    @classmethod
+    def for_messages(cls, convo_name, messages, path):
+        """Returns a WordIndex for messages, loading the index saved at path if it is for the same messages and
+        adding any messages that aren't yet in it. Nothing is written to path, see save()
+        Parameters:
+            convo_name: the name of the conversation, saved with the index to make sure it's for the right conversation
+            messages: a sequence of the text of each message in the conversation
+            path: the directory the index is saved in
+        """
+        start = time.time()
+        index = cls.load(path + cls.FILE_NAME, convo_name)
+        if index is None or not index._matches(messages):
+            index = cls(convo_name)
+        if index._length < len(messages):
+            index.add(messages)
+        index.build_time = time.time() - start
+        return index
+
+    @staticmethod
+    def content_hash(messages, length) -> str:
+        """Returns a hex digest of the first length messages of messages, the same whether messages is a list of
+        strings or MessageTexts
+        """
+        digest = hashlib.sha1()
+        if isinstance(messages, MessageTexts):  # hash the stored text without decoding it
+            digest.update(array('q', (messages.byte_length(i) for i in range(length))))
+            digest.update(messages.encoded(length))
+        else:
+            encoded = [msg.encode('utf-8') for msg in messages[:length]]
+            digest.update(array('q', (len(msg) for msg in encoded)))
+            digest.update(b''.join(encoded))
+        return digest.hexdigest()
+
+    @staticmethod
+    def fold(text) -> str:
+        """Returns text in lower case. A final sigma is replaced with a regular sigma so that folding a piece of a
+        string gives the same characters as the matching piece of the folded string
+        """
+        return text.lower().replace('ς', 'σ')
+
+    def add(self, messages):
+        """Indexes the messages in messages after the ones already indexed"""
+        for i in range(self._length, len(messages)):
+            for word in set(self.fold(messages[i]).split()):
+                if word not in self._words:
+                    self._words[word] = [i]
+                else:
+                    self._words[word].append(i)
+        self._length = len(messages)
+        self._hash = None
+        self._changed = True
+
+    def _matches(self, messages) -> bool:
+        """Returns whether messages starts with the messages in this index, judged by the saved hash"""
+        if self._length > len(messages):
+            return False
+        return self._hash == self.content_hash(messages, self._length)
+
+    def candidates(self, query):
+        """Returns a sorted list of the indexes of messages that might contain query, ignoring case, or None if the
+        index can't narrow the search down (e.g. query is only whitespace)
+        """
+        pieces = set(self.fold(query).split())
+        if len(pieces) == 0:
+            return None
+
+        # every whitespace separated piece of query has to be inside a single word of a message that contains query
+        res = None
+        for piece in sorted(pieces, key=len, reverse=True):  # longer pieces are in fewer words
+            matches = set()
+            for word, indexes in self._words.items():
+                if piece in word:
+                    matches.update(indexes)
+            res = matches if res is None else res & matches
+            if len(res) == 0:
+                break
+        return sorted(res)
+
+    @classmethod
+    def load(cls, file_path, convo_name):
+        """Returns the WordIndex saved at file_path, or None if there isn't one for convo_name saved by this version"""
+        try:
+            with open(file_path, mode='r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if index.get('version') != cls.VERSION or index.get('convo_name') != convo_name:
+            return None
+        return cls(convo_name, index['words'], index['length'], index['hash'])
+
+    def save(self, path, messages):
+        """Saves the index in the directory path if messages were added to it since it was loaded
+        Parameters:
+            path: the directory the index is saved in
+            messages: the messages the index was made for, hashed to check the index against them when it's loaded
+        """
+        if not self._changed:
+            return
+        if self._hash is None:
+            self._hash = self.content_hash(messages, self._length)
+        os.makedirs(path, exist_ok=True)
+        with open(path + self.FILE_NAME, mode='w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'convo_name': self.convo_name, 'length': self._length,
+                       'hash': self._hash, 'words': self._words}, f)
+        self._changed = False
+
+    def num_postings(self) -> int:
+        """Returns the total length of all the lists of message indexes"""
+        return sum(len(indexes) for indexes in self._words.values())
+
+    def __len__(self):
+        """Returns the number of distinct words indexed"""
+        return len(self._words)
+
+    def __str__(self):
+        return "Word index of {0:,} messages: {1:,} words, {2:,} postings, loaded/built in {3:.3f} seconds"\
+            .format(self._length, len(self), self.num_postings(), self.build_time)
+
+    def __repr__(self):
+        return "WordIndex({0}, length={1})".format(repr(self.convo_name), self._length)
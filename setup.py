@@ -1,18 +1,49 @@
 import os
+import json
 import time
 import shutil
 import textwrap
-import json
+import argparse
 from colorama import Fore, Back, Style, init
 
 from functions import setup_functions
-import functions.emojis as emojis
+from functions.messagestore import MessageStore
+from functions.aggregateindex import AggregateIndex
+from functions.baseconvoreader import BaseConvoReader
+from functions.wordindex import WordIndex
+from functions.mergedecisions import MergeDecisions
 
 init(autoreset=True)
 
+parser = argparse.ArgumentParser(description="Sets up the facebook archive in html/messages.htm for analysis")
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help="the number of processes used to parse the archive (default: 1)")
+parser.add_argument('-u', '--update', action='store_true',
+                    help="add only the messages in the archive that are newer than those already set up, keeping "
+                         "changes saved with m.save_convo_edits()")
+parser.add_argument('-a', '--auto-merge', action='store_true',
+                    help="decide whether threads with the same name are one conversation without asking, and replace "
+                         "the data saved by a previous setup without asking. Decisions are saved to {0} and reused by "
+                         "later setups either way".format(MergeDecisions.PATH))
+args = parser.parse_args()
+if args.jobs < 1:
+    parser.error("--jobs must be at least 1")
+
 
 # ------------------------------------------  CHECKING FOR PREVIOUS SETUP  ------------------------------------------- #
-if os.path.isfile('data/data.json'):
+store = None
+if args.update:
+    if MessageStore.exists():
+        store = MessageStore()
+        saved_msgs = {name: store.conversation(name) for name in store.names()}
+        saved_preferences = store.preferences
+    elif os.path.isfile('data/data.json'):
+        with open('data/data.json', mode='r', encoding='utf-8') as f:
+            saved_data = json.load(f)
+        saved_msgs, saved_preferences = saved_data['conversation_data'], saved_data['preferences']
+    else:
+        parser.error("--update needs the data saved by a previous setup")
+elif (os.path.isfile('data/data.json') or MessageStore.exists()) and not args.auto_merge:
     print("Are you sure you want to override the data currently saved?\n"
           "This might require resetting preferences. [Y/n]")
     choice = input("> ")
@@ -50,23 +81,24 @@ time_text = (
     "processor speed."
 )
 
-print(textwrap.fill(intro_text1, width=console_width))
-print()
-print(textwrap.fill(intro_text2, width=console_width))
-print()
+if not args.auto_merge:  # the user won't be asked anything
+    print(textwrap.fill(intro_text1, width=console_width))
+    print()
+    print(textwrap.fill(intro_text2, width=console_width))
+    print()
 print(textwrap.fill(time_text, width=console_width))
 print()
 
 os.makedirs('data', exist_ok=True)
-unordered_threads, footer = setup_functions.get_all_threads_unordered(
-    setup_functions.get_all_thread_containers('html/messages.htm')
-)
-
-msgs, footer, preferences = setup_functions.get_all_msgs_dict('html/messages.html', unordered_threads, footer, times)
-
-for convo_name, convo in msgs.items():
-    for i in range(len(convo)):
-        convo[i] = (convo[i][0], emojis.emojify(convo[i][1]), convo[i][2])
+threads = setup_functions.ThreadStream('html/messages.htm', jobs=args.jobs)
+decisions = MergeDecisions.load(auto_merge=args.auto_merge)
+
+if args.update:
+    msgs, footer, preferences, changed = setup_functions.update_msgs_dict('html/messages.htm', saved_msgs, threads,
+                                                                          None, times, decisions=decisions)
+else:
+    msgs, footer, preferences = setup_functions.get_all_msgs_dict('html/messages.htm', threads, None, times,
+                                                                  decisions=decisions)
 # ------------------------------------  BACKGROUND SETUP AND INFORMATION FOR USER  ---------------------------------- #
 
 
@@ -74,15 +106,34 @@ for convo_name, convo in msgs.items():
 
 
 # -------------------------------------------------  WRITING TO FILES  ----------------------------------------------- #
-all_data = {
-    'conversation_data': msgs,
-    'footer': footer,
-    'preferences': preferences
-}
-all_data = json.dumps(all_data)
-with open('data/data.json', mode='w', encoding='utf-8') as f:
-    f.write(all_data)
+decisions.save()
+stage_times = [time.time()]
+if args.update:
+    # conversations with new messages can change rank, and their saved preferences have to follow them
+    setup_functions.move_conversation_data(saved_preferences, preferences, path=BaseConvoReader.BASE_PATH)
+    # only conversations with new messages are written and summarized again
+    if store is not None:
+        store.save(msgs, footer, preferences)
+    else:
+        MessageStore.write(msgs, footer, preferences)
+    stage_times.append(time.time())
+    AggregateIndex.build(msgs, previous=AggregateIndex.load(), changed=changed).save()
+    stage_times.append(time.time())
+    num_added = sum(len(msgs[name]) - (len(saved_msgs[name]) if name in saved_msgs else 0) for name in changed)
+    print("Added {0:,} messages to {1:,} conversations\n".format(num_added, len(changed)))
+else:
+    MessageStore.write(msgs, footer, preferences)
+    stage_times.append(time.time())
+    AggregateIndex.build(msgs).save()
+    stage_times.append(time.time())
 os.makedirs('data/conversation_data', exist_ok=True)
+store = MessageStore()
+for name in store.names():
+    # saved indexes are checked against the messages, so only new conversations and messages are indexed
+    path = BaseConvoReader.BASE_PATH + str(preferences['length'][name][0]) + '/'
+    messages = store.conversation(name).messages
+    WordIndex.for_messages(name.lower(), messages, path).save(path, messages)  # named as BaseConvoReader names it
+stage_times.append(time.time())
 print('Setup will finish shortly\n')
 times.append(time.time())
 # -------------------------------------------------  WRITING TO FILES  ----------------------------------------------- #
@@ -94,6 +145,8 @@ times.append(time.time())
 # -------------------------------------------------  PRINTING TIMES  ------------------------------------------------- #
 # times should be in the following format:
 # [{start_time}, {after_user_says_continue}, {begin_user_input}, {end_user_input}, {end_setup}]
+# and stage_times in the format:
+# [{begin_writing}, {conversations_written}, {totals_written}, {word_indexes_written}]
 
 
 def time_string(time_as_seconds):
@@ -107,10 +160,13 @@ def time_string(time_as_seconds):
 
 
 real_times = [
-    "Background setup time: {0}".format(time_string(times[1] - times[0])),
+    "Background setup time (reading the archive): {0}".format(time_string(times[1] - times[0])),
     "User instruction time, prior to user input: {0}".format(time_string(times[2] - times[1])),
     "User input time: {0}".format(time_string(times[3] - times[2])),
     "Final processing time: {}".format(time_string(times[4] - times[3])),
+    "    Writing conversations: {}".format(time_string(stage_times[1] - stage_times[0])),
+    "    Totals over all conversations: {}".format(time_string(stage_times[2] - stage_times[1])),
+    "    Word indexes: {}".format(time_string(stage_times[3] - stage_times[2])),
 ]
 
 for ele in real_times:
@@ -126,9 +182,10 @@ print()
 
 from fancy_playground import *
 
-print(setup_functions.one_line())
-print()
-print("Would you like to launch the gui now?")
-if setup_functions.user_says_yes():
-    app.run()
+if not args.auto_merge:
+    print(setup_functions.one_line())
+    print()
+    print("Would you like to launch the gui now?")
+    if setup_functions.user_says_yes():
+        app.run()
 # -------------------------------------------------  PRINTING TIMES  ------------------------------------------------- #
@@ -0,0 +1,76 @@
+import os
+import io
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from functions import setup_functions
+from functions.setup_functions import PreferencesSearcher
+
+
+def message(person, text, minute):
+    return person, text, 'Sunday, March 1, 2015 at 1:{0:02d}pm PST'.format(minute)
+
+
+class TestUpdateMovesConversationData(unittest.TestCase):
+    """setup.py --update keeps each conversation's saved data with it when adding messages changes the ranks"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + '/'
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def save_preferences(self, rank, text):
+        os.makedirs(self.path + str(rank))
+        with open(self.path + str(rank) + '/preferences.txt', mode='w', encoding='utf-8') as f:
+            f.write(text)
+
+    def read_preferences(self, rank):
+        with open(self.path + str(rank) + '/preferences.txt', mode='r', encoding='utf-8') as f:
+            return f.read()
+
+    def test_preferences_follow_conversation(self):
+        msgs = {
+            'Alice, Me': [message('Alice', 'hi', 0), message('Me', 'hey', 1), message('Alice', 'bye', 2)],
+            'Bob, Me': [message('Bob', 'yo', 3), message('Me', 'sup', 4)],
+            'Carl, Me': [message('Carl', 'hello', 5)],
+        }
+        old_preferences = PreferencesSearcher.from_msgs_dict(msgs).preferences
+        self.assertEqual([old_preferences['length'][name][0] for name in sorted(msgs)], [1, 2, 3])
+        for name in msgs:
+            self.save_preferences(old_preferences['length'][name][0], name)
+
+        # the archive has four new messages from Carl, who now has the most messages
+        carl = msgs['Carl, Me'] + [message('Carl', 'more ' + str(i), 10 + i) for i in range(4)]
+        threads = [('Alice, Me', msgs['Alice, Me']), ('Bob, Me', msgs['Bob, Me']), ('Carl, Me', carl)]
+        with redirect_stdout(io.StringIO()):
+            res, _, new_preferences, changed = setup_functions.update_msgs_dict(None, msgs, threads, 'footer', [])
+        self.assertEqual(changed, {'Carl, Me'})
+        self.assertEqual([new_preferences['length'][name][0] for name in sorted(res)], [2, 3, 1])
+
+        setup_functions.move_conversation_data(old_preferences, new_preferences, path=self.path)
+        for name in res:
+            self.assertEqual(self.read_preferences(new_preferences['length'][name][0]), name)
+        self.assertEqual(sorted(os.listdir(self.path)), ['1', '2', '3'])
+
+    def test_new_and_removed_conversations(self):
+        old_preferences = PreferencesSearcher.from_msgs_dict({
+            'Alice, Me': [message('Alice', 'hi', 0), message('Me', 'hey', 1)],
+            'Bob, Me': [message('Bob', 'yo', 2)],
+        }).preferences
+        self.save_preferences(1, 'Alice, Me')
+        self.save_preferences(2, 'Bob, Me')
+
+        new_preferences = PreferencesSearcher.from_msgs_dict({
+            'Dan, Me': [message('Dan', 'a', 0), message('Dan', 'b', 1), message('Dan', 'c', 2)],
+            'Alice, Me': [message('Alice', 'hi', 0), message('Me', 'hey', 1)],
+        }).preferences
+        setup_functions.move_conversation_data(old_preferences, new_preferences, path=self.path)
+        self.assertEqual(os.listdir(self.path), ['2'])
+        self.assertEqual(self.read_preferences(2), 'Alice, Me')
+
+
+if __name__ == '__main__':
+    unittest.main()